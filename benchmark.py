@@ -0,0 +1,394 @@
+"""Steam好友管理工具性能基准
+
+在本地启动模拟的 api.steampowered.com 与头像CDN（可配置延迟、错误率和429注入），
+用 100 ~ 10000 个合成好友测量更新好友列表、刷新头像、查询用户和表格渲染的吞吐量、延迟分位数与内存峰值。
+
+用法:
+    python benchmark.py --sizes 100,1000,10000 --latency 50 --error-rate 0.01 --rate-429 0.02
+    python benchmark.py --sizes 1000 --ops update,table --json bench.jsonl
+"""
+import argparse
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import steam_core
+
+NAMES = ['Alpha', 'Bravo', 'Charlie', 'Delta', 'Echo', '狐狸', '小猫', 'Ночь', 'Zulu', 'Kilo']
+
+
+class MockSteamServer:
+    """本地模拟的 Steam Web API 与头像CDN
+
+    latency 为每个请求的平均延迟（秒），jitter 为延迟的相对抖动；error_rate 为返回500的比例，
+    rate_429 为 API 请求返回429（带 Retry-After）的比例。头像支持 ETag 条件请求
+    """
+    def __init__(self, latency=0.05, jitter=0.2, error_rate=0.0, rate_429=0.0, retry_after=0.2):
+        self.latency, self.jitter = latency, jitter
+        self.error_rate, self.rate_429, self.retry_after = error_rate, rate_429, retry_after
+        self.lock = threading.Lock()
+        self.ids = []
+        self.stats = {'requests': 0, 'errors': 0, 'throttled': 0, 'not_modified': 0, 'bytes': 0}
+        self.server = None
+
+    def set_friends(self, count, seed=0):
+        """生成 count 个合成好友"""
+        rng = random.Random(seed)
+        self.ids = [str(76561198000000000 + rng.randrange(10 ** 9)) for _ in range(count)]
+        self.since = {sid: 1300000000 + rng.randrange(4 * 10 ** 8) for sid in self.ids}
+        self.names = {sid: f"{rng.choice(NAMES)}{rng.randrange(10000)}" for sid in self.ids}
+
+    def start(self):
+        ThreadingHTTPServer.request_queue_size = 1024
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+
+            def do_POST(self): self.do_GET()
+
+            def do_GET(self):
+                mock._count('requests')
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                time.sleep(max(0, mock.latency * random.uniform(1 - mock.jitter, 1 + mock.jitter)))
+                is_avatar = url.path.startswith('/avatars/')
+
+                if not is_avatar and random.random() < mock.rate_429:
+                    mock._count('throttled')
+                    return self._send(429, b'', {'Retry-After': str(mock.retry_after)})
+                if random.random() < mock.error_rate:
+                    mock._count('errors')
+                    return self._send(500, b'Internal Server Error')
+                if is_avatar:
+                    return self._avatar(url.path)
+                self._send(200, json.dumps(mock._api(url.path, query)).encode(), {'Content-Type': 'application/json'})
+
+            def _avatar(self, path):
+                content = hashlib.sha256(path.encode()).digest() * 64  # 约2KB的确定性内容
+                etag = '"%s"' % hashlib.md5(content).hexdigest()
+                if self.headers.get('If-None-Match') == etag:
+                    mock._count('not_modified')
+                    return self._send(304, b'', {'ETag': etag})
+                self._send(200, content, {'ETag': etag, 'Content-Type': 'image/jpeg'})
+
+            def _send(self, status, body, headers=None):
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                mock._count('bytes', len(body))
+
+        return Handler
+
+    def _api(self, path, query):
+        if 'GetFriendList' in path:
+            return {'friendslist': {'friends': [
+                {'steamid': sid, 'relationship': 'friend', 'friend_since': self.since[sid]} for sid in self.ids
+            ]}}
+        if 'GetPlayerSummaries' in path:
+            ids = query.get('steamids', '').split(',')
+            return {'response': {'players': [{
+                'steamid': sid, 'personaname': self.names.get(sid, sid[-6:]), 'personastate': 1,
+                'profileurl': f"https://steamcommunity.com/profiles/{sid}/",
+                'avatar': f"{self.base_url}/avatars/{sid}.jpg", 'avatarfull': f"{self.base_url}/avatars/{sid}_full.jpg",
+                'timecreated': 1300000000
+            } for sid in ids if sid]}}
+        if 'GetPlayerBans' in path:
+            return {'players': [{
+                'SteamId': sid, 'VACBanned': sid.endswith('7'), 'NumberOfVACBans': int(sid.endswith('7')),
+                'DaysSinceLastBan': 30, 'NumberOfGameBans': 0, 'CommunityBanned': False, 'EconomyBan': 'none'
+            } for sid in query.get('steamids', '').split(',') if sid]}
+        if 'GetOwnedGames' in path:
+            return {'response': {'game_count': 120}}
+        if 'GetRecentlyPlayedGames' in path:
+            return {'response': {'games': [{'appid': 570, 'name': 'Dota 2', 'playtime_2weeks': 300}]}}
+        return {'response': {}}
+
+
+class HeadlessPage:
+    """只记录 update 次数的页面替身，用于在无界面环境下测量表格更新的耗时（不含 Flutter 渲染）"""
+    window_width, window_height = 900, 700
+
+    def __init__(self):
+        self.controls, self.updates = [], 0
+
+    def add(self, *controls):
+        self.controls.extend(controls)
+
+    def update(self, *controls):
+        self.updates += 1
+
+    def run_thread(self, handler, *args):
+        handler(*args)
+
+    def run_task(self, handler, *args):
+        return asyncio.run(handler(*args))
+
+
+def percentile(values, p):
+    """最近秩法求百分位数"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def measure(name, size, runs, func):
+    """运行 func 共 runs 次，返回耗时分位数和吞吐量；func 返回本次处理的条目数"""
+    durations, processed = [], 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        count = func()
+        durations.append(time.perf_counter() - started)
+        processed = count
+    median = percentile(durations, 50)
+    return {
+        'op': name, 'friends': size, 'runs': runs,
+        'p50_ms': round(median * 1000, 2), 'p90_ms': round(percentile(durations, 90) * 1000, 2),
+        'p99_ms': round(percentile(durations, 99) * 1000, 2),
+        'throughput': round(processed / median, 1) if processed and median else None
+    }
+
+
+def peak_memory(func):
+    """单独运行一次 func 并返回内存峰值（MB）；tracemalloc 会明显拖慢运行，因此不与计时混在一起"""
+    tracemalloc.start()
+    try:
+        func()
+        return round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+    finally:
+        tracemalloc.stop()
+
+
+class Benchmark:
+    def __init__(self, args, server):
+        self.args, self.server = args, server
+
+    def measure(self, name, size, runs, func):
+        """measure 的结果附加内存峰值，以及计时运行中平均每次产生的请求数、429和500次数"""
+        before = self.server.snapshot()
+        result = measure(name, size, runs, func)
+        after = self.server.snapshot()
+        result['peak_mb'] = peak_memory(func)
+        result.update({k: round((after[k] - before[k]) / runs, 1) for k in ('requests', 'throttled', 'errors')})
+        return result
+
+    def steam(self):
+        """在当前目录创建一个指向模拟服务器的 SteamFriendsFixedGUI"""
+        steam = steam_core.SteamFriendsFixedGUI(self.args.avatar_workers, base_url=self.server.base_url,
+                                          avatar_base_url=f"{self.server.base_url}/avatars")
+        steam.steam_web_api, steam.steam_id = 'BENCHMARK', '76561197960265728'
+        steam.set_max_workers(self.args.workers)
+        steam.set_rate_limit(self.args.rps)
+        return steam
+
+    def _retry(self, func):
+        """注入错误时重试（从检查点继续），返回尝试次数"""
+        for attempt in range(1, self.args.max_attempts + 1):
+            try:
+                func()
+                return attempt
+            except Exception:
+                if attempt == self.args.max_attempts: raise
+
+    def update(self, size):
+        """冷启动全量更新（等待头像全部下载）与增量更新"""
+        results = []
+
+        def full():
+            self._fresh_dir()
+            steam = self.steam()
+            done = threading.Event()
+            steam.on_avatars_ready = lambda count: done.set()
+            self._retry(steam.update_friends_list)
+            done.wait(self.args.timeout)
+            return size
+        results.append(self.measure('update_full', size, self.args.runs, full))
+
+        steam = self.steam()
+        self._retry(steam.update_friends_list)
+
+        def incremental():
+            self._retry(lambda: steam.update_friends_list(incremental=True))
+            return size
+        results.append(self.measure('update_incremental', size, self.args.runs, incremental))
+        return results
+
+    def update_async(self, size):
+        """异步请求层的冷启动全量更新（等待头像全部下载）"""
+        if not steam_core.httpx:
+            return []
+
+        def full():
+            self._fresh_dir()
+            steam = self.steam()
+
+            async def run():
+                done = asyncio.Event()
+                steam.on_avatars_ready = lambda count: done.set()
+                for attempt in range(self.args.max_attempts):
+                    try:
+                        await steam.async_client.update_friends_list()
+                        break
+                    except Exception:
+                        if attempt == self.args.max_attempts - 1: raise
+                await asyncio.wait_for(done.wait(), self.args.timeout)
+            asyncio.run(run())
+            return size
+        return [self.measure('update_full_async', size, self.args.runs, full)]
+
+    def avatars(self, size):
+        """所有头像均未变化时的重新验证（304）"""
+        steam = self.steam()
+        done = threading.Event()
+        steam.on_avatars_ready = lambda count: done.set()
+        self._retry(steam.update_friends_list)
+        done.wait(self.args.timeout)
+
+        def revalidate():
+            steam.refresh_avatars()
+            return size
+        return [self.measure('refresh_avatars', size, self.args.runs, revalidate)]
+
+    def user_info(self, size):
+        """单个用户信息查询（每次清空响应缓存）"""
+        steam = self.steam()
+        friend_code = str(int(self.server.ids[0]) - 76561197960265728)  # 好友代码即32位账号ID
+
+        def lookup():
+            steam.response_cache = steam_core.ResponseCache()
+            self._retry(lambda: steam.get_user_info(friend_code))
+            return 1
+        return [self.measure('get_user_info', size, max(self.args.runs, 20), lookup)]
+
+    def table(self, size):
+        """内存中的表格更新：翻页、切换排序和筛选"""
+        import main  # 只有表格基准需要 Flet
+        store = steam_core.FriendsStore()
+        rng = random.Random(1)
+        store.upsert_many([{
+            'steamid': sid, 'name': self.server.names[sid], 'avatar': f"avatar_cache/{sid}.jpg",
+            'is_friend': '✅' if rng.random() < 0.9 else '❌', 'friend_since': self.server.since[sid],
+            'bfd': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.server.since[sid])),
+            'removed_time': '', 'remark': rng.choice(['', '', '', 'vip', '同学', 'trade'])
+        } for sid in self.server.ids])
+        store.conn.close()
+
+        app = main.SteamFriendsApp()
+        app.main(HeadlessPage())
+        app.friends.reload()
+        app._update_data_table()
+        pages = max(1, -(-size // app.page_size))
+
+        def paging():
+            app._change_table_page(1 if app.table_page < pages - 1 else -app.table_page)
+            return app.page_size
+
+        def sorting():
+            app._toggle_sort(rng.choice(list(steam_core.FriendsRepository.sort_keys)))
+            return size
+
+        def filtering():
+            app.search_input.value = rng.choice(NAMES)[:rng.randrange(1, 5)]
+            app._apply_filter()
+            return size
+
+        results = [self.measure(name, size, max(self.args.runs, 20), func)
+                   for name, func in (('table_page', paging), ('table_sort', sorting), ('table_filter', filtering))]
+        app.friends.flush()
+        return results
+
+    def _fresh_dir(self):
+        """切换到空的工作目录，使每次冷启动都不受上次数据和头像缓存影响"""
+        path = tempfile.mkdtemp(prefix='run-', dir=self.root)
+        os.chdir(path)
+
+    def run(self, size):
+        """逐个操作产出结果；某个操作失败时输出错误并继续下一个操作，已完成的结果不会丢失"""
+        self.root = tempfile.mkdtemp(prefix=f'steam-bench-{size}-')
+        # 头像索引等在退出时才保存，先注册的清理会在它们之后执行
+        atexit.register(shutil.rmtree, self.root, True)
+        try:
+            self.server.set_friends(size)
+            for op in self.args.ops:
+                self._fresh_dir()
+                try:
+                    results = getattr(self, op)(size)
+                except Exception as e:
+                    print(f"{op} ({size}) 失败: {e}", file=sys.stderr, flush=True)
+                    continue
+                yield from results
+        finally:
+            os.chdir(self.cwd)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Steam好友管理工具性能基准（本地模拟服务器）")
+    parser.add_argument('--sizes', default='100,1000,10000', help="好友数量，逗号分隔")
+    parser.add_argument('--ops', default='update,update_async,avatars,user_info,table',
+                        help="要运行的操作：update, update_async, avatars, user_info, table")
+    parser.add_argument('--runs', type=int, default=3, help="每个操作的重复次数")
+    parser.add_argument('--latency', type=float, default=50, help="模拟服务器平均延迟（毫秒）")
+    parser.add_argument('--jitter', type=float, default=0.2, help="延迟的相对抖动")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="返回500的请求比例")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="API请求返回429的比例")
+    parser.add_argument('--rps', type=float, default=200, help="客户端速率上限（每秒请求数）")
+    parser.add_argument('--workers', type=int, default=4, help="资料请求并发数")
+    parser.add_argument('--avatar-workers', type=int, default=8, help="头像下载并发数")
+    parser.add_argument('--max-attempts', type=int, default=10, help="注入错误时每次更新的最大尝试次数")
+    parser.add_argument('--timeout', type=float, default=300, help="等待头像下载完成的超时（秒）")
+    parser.add_argument('--json', help="将结果以JSON行追加写入该文件")
+    args = parser.parse_args()
+    args.ops = [op.strip() for op in args.ops.split(',') if op.strip()]
+
+    server = MockSteamServer(args.latency / 1000, args.jitter, args.error_rate, args.rate_429).start()
+    bench = Benchmark(args, server)
+    bench.cwd = os.getcwd()
+    columns = ['op', 'friends', 'runs', 'p50_ms', 'p90_ms', 'p99_ms', 'throughput', 'peak_mb', 'requests', 'throttled', 'errors']
+    print(' '.join(f"{c:>18}" if i == 0 else f"{c:>10}" for i, c in enumerate(columns)))
+    try:
+        for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            for result in bench.run(size):
+                print(' '.join(f"{str(result.get(c)):>18}" if i == 0 else f"{str(result.get(c)):>10}"
+                               for i, c in enumerate(columns)), flush=True)
+                if args.json:
+                    with open(os.path.join(bench.cwd, args.json), 'a', encoding='utf-8') as f:
+                        f.write(json.dumps({**result, 'latency_ms': args.latency, 'error_rate': args.error_rate,
+                                            'rate_429': args.rate_429, 'time': int(time.time())}, ensure_ascii=False) + '\n')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,166 @@
+"""Steam好友管理工具无界面模式：不加载 Flet，适合在服务器上定时保存好友快照
+
+用法:
+    python headless.py snapshot --incremental --scan-bans
+    python headless.py daemon --interval 3600 --jitter 0.1 --data-dir /srv/steam-friends
+
+API Key、Steam ID 和代理默认读取数据目录下的 steam_settings.json，也可以通过参数或
+环境变量 STEAM_API_KEY / STEAM_ID / STEAM_PROXY 指定。
+"""
+import argparse
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from datetime import datetime
+
+from steam_core import LockFile, SettingsManager, SteamFriendsFixedGUI, metrics
+
+
+def log(message):
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}", flush=True)
+
+
+class HeadlessRunner:
+    """按设置执行一次完整的快照：更新好友列表（等待头像下载完成）、可选刷新头像和扫描封禁"""
+    def __init__(self, args):
+        self.args = args
+        self.settings = SettingsManager().load_settings()
+        if args.metrics:
+            metrics.enabled = True
+        self.steam = SteamFriendsFixedGUI(
+            self.settings.get('avatar_workers', 8), self.settings.get('avatar_cache_mb', 200) * 1024 * 1024,
+            'api_cache.db' if self.settings.get('api_cache_persist', True) else None
+        )
+        self.steam.steam_web_api = args.api_key or os.environ.get('STEAM_API_KEY') or self.settings.get('api_key')
+        self.steam.steam_id = args.steam_id or os.environ.get('STEAM_ID') or self.settings.get('steam_id')
+        self.steam.set_proxy(args.proxy or os.environ.get('STEAM_PROXY') or self.settings.get('proxy'))
+        self.steam.set_max_workers(self.settings.get('max_workers', 4))
+        self.steam.set_rate_limit(self.settings.get('requests_per_second', 5))
+        self.steam.lock_file = args.lock_file
+        if not self.steam.steam_web_api or not self.steam.steam_id:
+            raise Exception("缺少 API Key 或 Steam ID，请在 steam_settings.json 中设置或通过参数指定")
+
+    def run_once(self):
+        """执行一次快照，返回是否全部成功；其他实例（图形界面或无界面模式）正在刷新时跳过并返回 None
+        
+        只在运行期间持有刷新锁，daemon 等待下次运行时图形界面可以正常更新
+        """
+        lock = LockFile(self.args.lock_file)
+        if not lock.acquire():
+            log(f"另一个实例正在使用 {lock.path}，跳过本次运行")
+            return None
+        try:
+            return self._run()
+        finally:
+            lock.release()
+
+    def _run(self):
+        args, steam = self.args, self.steam
+        started, ok = time.time(), True
+        avatars_done = threading.Event()
+        steam.on_avatars_ready = lambda count: (log(f"头像下载完成，更新 {count} 个"), avatars_done.set())
+
+        try:
+            incremental = self.settings.get('incremental_refresh', True) if args.incremental is None else args.incremental
+            data = steam.update_friends_list(incremental, self.settings.get('summary_max_age_hours', 24) * 3600)
+            stats = steam.last_refresh_stats
+            log(f"更新完成，共 {len(data)} 条记录（获取 {stats['fetched']} 个好友资料，跳过 {stats['skipped']} 个）")
+            if steam.avatar_futures and not avatars_done.wait(args.avatar_timeout):
+                log("等待头像下载超时，剩余头像将在下次运行时继续下载")
+        except Exception as e:
+            log(f"更新失败: {e}")
+            ok = False
+
+        if ok and args.refresh_avatars:
+            try:
+                log(f"已刷新 {steam.refresh_avatars()} 个头像")
+            except Exception as e:
+                log(f"刷新头像失败: {e}")
+                ok = False
+
+        if ok and args.scan_bans:
+            try:
+                scanned, banned = steam.scan_friend_bans(self.settings.get('ban_scan_ttl_hours', 24) * 3600)
+                log(f"已扫描 {scanned} 个好友的封禁记录，其中 {banned} 个有封禁记录")
+            except Exception as e:
+                log(f"扫描封禁失败: {e}")
+                ok = False
+
+        if args.export_csv:
+            try:
+                log(f"已导出 {steam.export_friends_csv(args.export_csv)} 条记录到 {args.export_csv}")
+            except Exception as e:
+                log(f"导出CSV失败: {e}")
+                ok = False
+        if args.metrics:
+            try:
+                metrics.export(args.metrics, 'prometheus')
+            except Exception as e:
+                log(f"导出指标失败: {e}")
+                ok = False
+        log(f"本次运行{'完成' if ok else '未全部完成'}，用时 {time.time() - started:.1f} 秒")
+        return ok
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Steam好友管理工具无界面模式")
+    parser.add_argument('command', choices=['snapshot', 'daemon'], help="snapshot 执行一次；daemon 按间隔持续运行")
+    parser.add_argument('--data-dir', default='.', help="数据目录（steam_settings.json、friends_data.db 等所在目录）")
+    parser.add_argument('--api-key', help="Steam Web API Key")
+    parser.add_argument('--steam-id', help="自己的 SteamID64")
+    parser.add_argument('--proxy', help="HTTP代理")
+    incremental = parser.add_mutually_exclusive_group()
+    incremental.add_argument('--incremental', dest='incremental', action='store_true', default=None,
+                             help="只获取新增好友和资料过期的好友（默认按设置 incremental_refresh）")
+    incremental.add_argument('--full', dest='incremental', action='store_false', help="获取全部好友的资料")
+    parser.add_argument('--refresh-avatars', action='store_true', help="更新后重新验证所有头像")
+    parser.add_argument('--scan-bans', action='store_true', help="更新后扫描封禁记录（按 ban_scan_ttl_hours 跳过近期已扫描的好友）")
+    parser.add_argument('--export-csv', metavar='FILE', help="每次运行后导出CSV")
+    parser.add_argument('--metrics', metavar='FILE', help="记录指标并在每次运行后以 Prometheus 文本格式写入该文件")
+    parser.add_argument('--avatar-timeout', type=float, default=600, help="等待头像下载完成的最长秒数")
+    parser.add_argument('--interval', type=float, default=3600, help="daemon 模式的运行间隔（秒）")
+    parser.add_argument('--jitter', type=float, default=0.1, help="间隔的随机抖动比例，避免多个实例同时请求")
+    parser.add_argument('--lock-file', default='steam_friends.lock',
+                        help="刷新锁文件（相对于数据目录），与图形界面共用，只在每次运行期间持有")
+    parser.add_argument('--instance-lock', default='steam_friends_daemon.lock',
+                        help="daemon 的单实例锁文件（相对于数据目录），整个运行期间持有")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.chdir(args.data_dir)
+    try:
+        runner = HeadlessRunner(args)
+    except Exception as e:
+        log(str(e))
+        return 1
+
+    if args.command == 'snapshot':
+        return {True: 0, False: 1, None: 2}[runner.run_once()]
+
+    # 单实例锁与刷新锁分开：daemon 休眠期间不阻止图形界面或 snapshot 刷新
+    lock = LockFile(args.instance_lock)
+    if not lock.acquire():
+        log(f"另一个 daemon 正在使用 {lock.path}，退出")
+        return 2
+    try:
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda signum, frame: stop.set())
+        while not stop.is_set():
+            runner.run_once()
+            delay = args.interval * random.uniform(1 - args.jitter, 1 + args.jitter)
+            log(f"下次运行时间 {datetime.fromtimestamp(time.time() + delay).strftime('%Y-%m-%d %H:%M:%S')}")
+            stop.wait(delay)
+        log("已停止")
+        return 0
+    finally:
+        lock.release()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
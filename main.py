@@ -1,421 +1,134 @@
 import flet as ft
-import requests
-import json
-import re
-import csv
-from datetime import datetime
-import os
+import asyncio
 import threading
+import time
+from datetime import datetime, timedelta
 
+from steam_core import SettingsManager, FriendsRepository, SteamFriendsFixedGUI, metrics
 
-class SettingsManager:
-    def __init__(self):
-        self.settings_file = 'steam_settings.json'
-        self.defaults = {
-            'api_key': '', 'steam_id': '', 'proxy': '',
-            'window_width': 900, 'window_height': 700
-        }
-    
-    def load_settings(self):
-        """加载设置"""
-        try:
-            if os.path.exists(self.settings_file):
-                with open(self.settings_file, 'r', encoding='utf-8') as f:
-                    return {**self.defaults, **json.load(f)}
-        except: pass
-        return self.defaults.copy()
-    
-    def save_settings(self, settings):
-        """保存设置"""
-        try:
-            with open(self.settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, indent=2, ensure_ascii=False)
-            return True
-        except Exception as e:
-            print(f"保存设置失败: {e}")
-            return False
-
-
-class SteamFriendsFixedGUI:
-    def __init__(self):
-        self.steam_web_api = self.steam_id = None
-        self.friends = 0
-        self.friends_list = {}
-        self.friend_data = []
-        
-        self.base_url = 'https://api.steampowered.com'
-        self.urls = {
-            'friends': 'https://api.steampowered.com/ISteamUser/GetFriendList/v0001/',
-            'summaries': 'https://api.steampowered.com/ISteamUser/GetPlayerSummaries/v0002/',
-            'remove_friend': 'https://api.steampowered.com/ISteamUser/RemoveFriend/v1/'
-        }
-        
-        self.sess = requests.Session()
-        self.sess.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
-        
-        self.avatar_dir = 'avatar_cache'
-        os.makedirs(self.avatar_dir, exist_ok=True)
-
-    def set_proxy(self, proxy):
-        if proxy:
-            self.sess.proxies.update({'http': proxy, 'https': proxy})
 
-    def get_friend_list(self):
-        response = self.sess.get(self.urls['friends'], params={'key': self.steam_web_api, 'steamid': self.steam_id})
-        
-        if response.status_code == 200:
-            friends = response.json()['friendslist']['friends']
-            self.friends_list = {f['steamid']: f['friend_since'] for f in friends}
-            self.friends = len(self.friends_list)
-            return True
-            
-        status_map = {
-            401: "Unauthorized，请检查你的steam隐私设置",
-            403: "403 Forbidden，请检查你的web_api和id的值",
-            500: "服务器内部错误，请检查你的steamid的值"
-        }
-        raise Exception(status_map.get(response.status_code, f"收到未处理的状态码：{response.status_code}"))
-
-    def get_friends_summaries(self):
-        steam_ids = list(self.friends_list.keys())
+class FriendRowView:
+    """好友表格中一行的控件，翻页或刷新时重新绑定数据而不重新创建"""
+    def __init__(self, app):
+        self.steamid, self.bound = None, None
+        
+        # 选择复选框
+        self.checkbox = ft.Checkbox(on_change=lambda e: app._toggle_friend_selection(self.steamid, e.control.value))
+        
+        # 头像 - 居中显示
+        self.avatar_image = ft.Image(width=36, height=36, fit=ft.ImageFit.COVER, border_radius=18)
+        avatar = ft.Container(
+            content=self.avatar_image,
+            width=40, 
+            height=40, 
+            border_radius=20, 
+            clip_behavior=ft.ClipBehavior.ANTI_ALIAS,
+            bgcolor=ft.Colors.BLUE_50,
+            alignment=ft.alignment.center
+        )
         
-        for i in range(0, len(steam_ids), 100):
-            batch = ','.join(steam_ids[i:i+100])
-            response = self.sess.get(self.urls['summaries'], params={'key': self.steam_web_api, 'steamids': batch})
-            
-            if response.status_code != 200:
-                raise Exception("429 Too Many Requests" if response.status_code == 429 else response.text)
-            
-            for user in response.json()['response']['players']:
-                self.friend_data.append({
-                    'avatar': self.download_avatar(user['avatar'], user['steamid']),
-                    'name': re.sub(r'[|\-+:"\'\n\r]', '`', user['personaname']),
-                    'steamid': user['steamid'],
-                    'is_friend': '✅',
-                    'bfd': datetime.fromtimestamp(self.friends_list[user['steamid']]).strftime('%Y-%m-%d %H:%M:%S'),
-                    'removed_time': '',
-                    'remark': ''
-                })
-
-    def read_friends_data(self):
-        """读取好友数据"""
-        try:
-            with open('friends_data.csv', 'r', encoding='utf-8-sig', newline='') as f:
-                return list(csv.DictReader(f))
-        except: return []
-
-    def save_friends_data(self, data):
-        """保存好友数据"""
-        if not data: return
-        with open('friends_data.csv', 'w', encoding='utf-8-sig', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=data[0].keys())
-            writer.writeheader()
-            writer.writerows(data)
-    
-    def download_avatar(self, url, steamid):
-        """下载头像"""
-        filepath = os.path.join(self.avatar_dir, f"{steamid}_{os.path.basename(url)}")
+        # 昵称 - 加粗显示并居中
+        self.name_text = ft.Text(weight=ft.FontWeight.W_500, size=14, text_align=ft.TextAlign.CENTER, width=120)
         
-        if not os.path.exists(filepath):
-            try:
-                with open(filepath, 'wb') as f:
-                    f.write(self.sess.get(url, timeout=10).content)
-            except: return url
-        return filepath
-
-    def update_friends_list(self):
-        """更新好友列表"""
-        self.get_friend_list()
-        self.get_friends_summaries()
-        
-        data = self.read_friends_data()
-        current = {f['steamid']: f for f in self.friend_data}
-        data_dict = {d['steamid']: d for d in data}
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        updated = []
-        
-        # 处理当前好友
-        for steamid, friend_info in current.items():
-            if steamid in data_dict:
-                data_dict[steamid].update(friend_info)
-                updated.append(data_dict.pop(steamid))
-            else:
-                updated.append(friend_info)
+        # Steam ID - 超链接
+        self.steam_id_button = ft.TextButton(
+            style=ft.ButtonStyle(
+                color=ft.Colors.BLUE_600,
+                text_style=ft.TextStyle(
+                    font_family="monospace",
+                    size=12,
+                    decoration=ft.TextDecoration.UNDERLINE
+                )
+            ),
+            on_click=lambda e: app._open_steam_profile(self.steamid)
+        )
         
-        # 处理已删除的好友
-        for d in data_dict.values():
-            if d['is_friend'] == '✅':
-                d.update({'is_friend': '❌', 'removed_time': d.get('removed_time') or now})
-            updated.append(d)
+        # 好友状态 - 文本显示并居中
+        self.status_text = ft.Text(size=12, weight=ft.FontWeight.W_500, text_align=ft.TextAlign.CENTER, width=60)
+        
+        # 时间显示 - 格式化并居中
+        self.bfd_text = ft.Text(size=12, text_align=ft.TextAlign.CENTER, width=120)
+        self.removed_text = ft.Text(size=12, text_align=ft.TextAlign.CENTER, width=120)
+        
+        # 备注 - 美化输入框
+        self.remark = ft.TextField(
+            width=200, 
+            height=32, 
+            dense=True,
+            border=ft.InputBorder.UNDERLINE,
+            filled=True,
+            text_size=12,
+            hint_text="点击添加备注...",
+            bgcolor=ft.Colors.with_opacity(0.05, ft.Colors.BLUE_50),
+            content_padding=ft.padding.only(left=8, right=8, top=8, bottom=4),
+            border_color=ft.Colors.BLUE_200,
+            focused_border_color=ft.Colors.BLUE_500,
+            cursor_color=ft.Colors.BLUE_500,
+            on_change=lambda e: app._update_remark(self.steamid, e.control.value),
+            on_blur=lambda e: app.friends.flush()
+        )
         
-        self.save_friends_data(updated)
-        return updated
-
-    def delete_non_friends(self):
-        """删除非好友记录"""
-        data = self.read_friends_data()
-        if not data: return []
-        current = [d for d in data if d['is_friend'] == '✅']
-        self.save_friends_data(current)
-        return current
+        self.row = ft.DataRow([
+            ft.DataCell(self.checkbox),
+            ft.DataCell(avatar),
+            ft.DataCell(self.name_text),
+            ft.DataCell(self.steam_id_button),
+            ft.DataCell(self.status_text),
+            ft.DataCell(self.bfd_text),
+            ft.DataCell(self.removed_text),
+            ft.DataCell(self.remark)
+        ])
 
-    def remove_friend(self, friend_steamid):
-        """删除好友"""
-        response = self.sess.post(self.urls['remove_friend'], params={
-            'key': self.steam_web_api,
-            'steamid': self.steam_id,
-            'friendid': friend_steamid
-        })
-        
-        if response.status_code == 200:
-            return True
-        elif response.status_code == 401:
-            raise Exception("Unauthorized，请检查你的steam隐私设置")
-        elif response.status_code == 403:
-            raise Exception("403 Forbidden，请检查你的web_api和id的值")
-        elif response.status_code == 500:
-            raise Exception("服务器内部错误，请检查你的steamid的值")
-        else:
-            raise Exception(f"删除好友失败，状态码：{response.status_code}")
-    
-    def get_user_info(self, friend_code):
-        """通过好友代码获取用户信息"""
-        # 将好友代码转换为SteamID64
-        steamid64 = self._friend_code_to_steamid(friend_code)
-        
-        if not steamid64:
-            raise Exception("无效的好友代码")
-        
-        url = f"{self.base_url}/ISteamUser/GetPlayerSummaries/v2/"
-        params = {
-            'key': self.steam_web_api,
-            'steamids': steamid64
-        }
-        
-        response = self._make_request(url, params)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            if 'response' in data and 'players' in data['response'] and len(data['response']['players']) > 0:
-                user_info = data['response']['players'][0]
-                # 获取游戏数量
-                user_info['game_count'] = self.get_user_game_count(steamid64)
-                # 获取封禁信息
-                user_info['ban_info'] = self.get_user_ban_info(steamid64)
-                # 获取最近游戏信息
-                user_info['recent_game'] = self.get_recent_most_played_game(steamid64)
-                return user_info
-            else:
-                raise Exception("未找到用户信息")
-        elif response.status_code == 401:
-            raise Exception("API密钥无效或已过期")
-        elif response.status_code == 500:
-            raise Exception("Steam服务器内部错误")
-        else:
-            raise Exception(f"获取用户信息失败: HTTP {response.status_code}")
-    
-    def get_user_game_count(self, steamid64):
-        """获取用户游戏数量"""
-        url = f"{self.base_url}/IPlayerService/GetOwnedGames/v0001/"
-        params = {
-            'key': self.steam_web_api,
-            'steamid': steamid64,
-            'include_played_free_games': '1',
-            'format': 'json'
-        }
-        
-        try:
-            response = self._make_request(url, params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'response' in data and 'game_count' in data['response']:
-                    return data['response']['game_count']
-                else:
-                    return 0
-            else:
-                # 如果获取游戏数量失败，返回0
-                return 0
-        except Exception as e:
-            print(f"获取游戏数量失败: {e}")
-            return 0
-    
-    def get_user_ban_info(self, steamid64):
-        """获取用户封禁信息"""
-        url = f"{self.base_url}/ISteamUser/GetPlayerBans/v0001/"
-        params = {
-            'key': self.steam_web_api,
-            'steamids': steamid64
-        }
-        
-        try:
-            response = self._make_request(url, params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'players' in data and len(data['players']) > 0:
-                    ban_info = data['players'][0]
-                    return {
-                        'VACBanned': ban_info.get('VACBanned', False),
-                        'NumberOfVACBans': ban_info.get('NumberOfVACBans', 0),
-                        'DaysSinceLastBan': ban_info.get('DaysSinceLastBan', 0),
-                        'NumberOfGameBans': ban_info.get('NumberOfGameBans', 0),
-                        'CommunityBanned': ban_info.get('CommunityBanned', False),
-                        'EconomyBan': ban_info.get('EconomyBan', 'none')
-                    }
-                else:
-                    return None
-            else:
-                # 如果获取封禁信息失败，返回None
-                return None
-        except Exception as e:
-            print(f"获取封禁信息失败: {e}")
-            return None
-    
-    def get_recent_most_played_game(self, steamid64):
-        """获取两周内玩的最多的游戏"""
-        url = f"{self.base_url}/IPlayerService/GetRecentlyPlayedGames/v0001/"
-        params = {
-            'key': self.steam_web_api,
-            'steamid': steamid64
-        }
-        
-        try:
-            response = self._make_request(url, params)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'response' in data:
-                    games = data['response'].get('games', [])
-                    
-                    if not games:
-                        return None  # 最近2周没有游玩记录
-                    
-                    # 按两周内时长降序排序，取第一个
-                    most_played = sorted(games, key=lambda x: x.get('playtime_2weeks', 0), reverse=True)[0]
-                    
-                    return {
-                        'name': most_played.get('name', '未知游戏'),
-                        'appid': most_played.get('appid', 0),
-                        'playtime_2weeks': most_played.get('playtime_2weeks', 0),
-                        'playtime_forever': most_played.get('playtime_forever', 0),
-                        'img_icon_url': most_played.get('img_icon_url', ''),
-                        'img_logo_url': most_played.get('img_logo_url', '')
-                    }
-                else:
-                    return None
-            else:
-                # 如果获取最近游戏信息失败，返回None
-                return None
-        except Exception as e:
-            print(f"获取最近游戏信息失败: {e}")
-            return None
-    
-    def send_friend_request(self, steamid64):
-        """发送好友申请"""
-        url = f"{self.base_url}/ISteamUser/AddFriend/v1/"
-        params = {
-            'key': self.steam_web_api,
-            'steamid': self.steam_id,
-            'friendid': steamid64
-        }
-        
-        response = self._make_request(url, params)
-        if response.status_code == 200:
-            return True
-        elif response.status_code == 401:
-            raise Exception("API密钥无效或已过期")
-        elif response.status_code == 403:
-            raise Exception("权限不足，无法发送好友申请")
-        elif response.status_code == 500:
-            raise Exception("Steam服务器内部错误")
-        else:
-            raise Exception(f"发送好友申请失败: HTTP {response.status_code}")
-    
-    def _make_request(self, url, params):
-        """发送HTTP请求"""
-        return self.sess.get(url, params=params)
-    
-    def _friend_code_to_steamid(self, friend_code):
-        """将好友代码转换为SteamID64"""
-        try:
-            # 移除可能的格式字符
-            friend_code = friend_code.strip().replace('-', '').replace(' ', '')
-            
-            # 检查是否是数字格式（直接是SteamID64）
-            if friend_code.isdigit() and len(friend_code) == 17:
-                return friend_code
-            
-            # 检查是否是SteamID格式（STEAM_0:0:12345678）
-            if friend_code.startswith('STEAM_'):
-                parts = friend_code.split(':')
-                if len(parts) == 3:
-                    y = int(parts[1])
-                    z = int(parts[2])
-                    steamid64 = str(76561197960265728 + (z * 2) + y)
-                    return steamid64
-            
-            # 检查是否是纯数字（可能是SteamID32或其他格式）
-            if friend_code.isdigit():
-                # 尝试将数字转换为SteamID64
-                # SteamID64 = 76561197960265728 + SteamID32
-                steamid32 = int(friend_code)
-                steamid64 = str(76561197960265728 + steamid32)
-                return steamid64
-            
-            # 检查是否是好友代码格式（FCABC-DEF-GHI）
-            if len(friend_code) >= 8 and friend_code.isalnum():
-                # Steam好友代码转换算法
-                try:
-                    # 如果是17位数字，直接返回
-                    if len(friend_code) == 17:
-                        return friend_code
-                    
-                    # 尝试解析为Steam好友代码
-                    # Steam好友代码使用Base58编码
-                    
-                    # Base58字符集
-                    base58_chars = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
-                    
-                    # 反转字符串以便计算
-                    friend_code_reversed = friend_code[::-1]
-                    
-                    # Base58解码
-                    code_num = 0
-                    for i, char in enumerate(friend_code_reversed):
-                        if char in base58_chars:
-                            code_num += base58_chars.index(char) * (58 ** i)
-                        else:
-                            return None
-                    
-                    # 转换为SteamID64
-                    # SteamID64 = 76561197960265728 + code_num
-                    steamid64 = str(76561197960265728 + code_num)
-                    return steamid64
-                    
-                except Exception as e:
-                    return None
-            
-            return None
-        except Exception as e:
-            return None
+    def bind(self, item, selected):
+        """绑定一条好友记录，数据未变化时直接跳过；Flet 只会下发值真正改变的属性"""
+        bans = [text for text, hit in [(f"VAC封禁 {item.get('vac_bans')}次", item.get('vac_banned')),
+                                       (f"游戏封禁 {item.get('game_bans')}次", item.get('game_bans')),
+                                       ("社区封禁", item.get('community_banned'))] if hit]
+        values = (selected, item['avatar'], item['name'], item['steamid'], item['is_friend'],
+                  item['bfd'], item['removed_time'], item['remark'], tuple(bans))
+        if values == self.bound: return
+        self.bound = values
+        
+        self.steamid = item['steamid']
+        self.checkbox.value = selected
+        self.avatar_image.src = item['avatar']
+        self.name_text.value = item['name']
+        self.steam_id_button.text = item['steamid']
+        self.status_text.value = item['is_friend'] + (" ⚠" if bans else "")
+        self.status_text.tooltip = "，".join(bans) if bans else None
+        self.bfd_text.value = item['bfd'] or "-"
+        self.removed_text.value = item['removed_time'] or "-"
+        self.remark.value = item['remark'] or ''
 
 
 class SteamFriendsApp:
     def __init__(self):
-        self.steam_friends, self.settings_manager = SteamFriendsFixedGUI(), SettingsManager()
+        self.settings_manager = SettingsManager()
         self.settings, self.page = self.settings_manager.load_settings(), None
-        self.selected_friends = {}  # 存储选中的好友
+        self.steam_friends = SteamFriendsFixedGUI(
+            self.settings.get('avatar_workers', 8), self.settings.get('avatar_cache_mb', 200) * 1024 * 1024,
+            'api_cache.db' if self.settings.get('api_cache_persist', True) else None
+        )
+        self.friends = FriendsRepository(self.steam_friends.store)  # 内存中的好友数据及选中状态
+        self.page_size = int(self.settings.get('table_page_size', 100))  # 表格每页显示条数
+        self.table_page = 0
+        self.row_cache = {}  # steamid -> 当前显示该好友的行控件
+        self.free_row_views = []  # 已移出当前页、可重新绑定的行控件
+        self.table_lock = threading.RLock()  # Flet 在线程池中并发执行事件处理和 run_thread 回调，表格渲染需串行
+        self.refresh_batches_shown = 0  # 本次刷新已显示的批次数，乱序到达的批次不会让进度倒退
         self.current_user_info = None  # 当前查询的用户信息
+        metrics.enabled = bool(self.settings.get('metrics_enabled', False))
+        self.steam_friends.on_avatars_ready = lambda count: self.page.run_thread(lambda: self._finish_avatar_download(count))
     
     def _setup_steam_api(self):
         """设置Steam API配置"""
         self.steam_friends.steam_web_api = self.api_key_input.value
         self.steam_friends.steam_id = self.steam_id_input.value
         self.steam_friends.set_proxy(self.proxy_input.value)
+        self.steam_friends.set_max_workers(self.settings.get('max_workers', 4))
+        self.steam_friends.set_rate_limit(self.settings.get('requests_per_second', 5))
+        if self.steam_friends.async_client:
+            self.steam_friends.async_client.max_concurrency = int(self.settings.get('async_concurrency', 16))
     
     def _disable_buttons(self, buttons):
         """禁用指定的按钮"""
@@ -439,7 +152,13 @@ class SteamFriendsApp:
     def _hide_progress(self):
         """隐藏进度条"""
         self.progress_bar.visible = False
+        self._update_cache_stats()
         self.page.update()
+
+    def _update_cache_stats(self):
+        """在状态栏显示API缓存命中情况"""
+        stats = self.steam_friends.response_cache.stats()
+        self.cache_stats_text.value = f"API缓存 命中 {stats['hits']} / 未命中 {stats['misses']}"
     
     def _run_thread_task(self, task_func, finish_func):
         """运行线程任务的通用方法"""
@@ -448,9 +167,27 @@ class SteamFriendsApp:
                 result = task_func()
                 self.page.run_thread(lambda: finish_func(True, result))
             except Exception as e:
-                self.page.run_thread(lambda: finish_func(False, str(e)))
+                self.page.run_thread(lambda error=str(e): finish_func(False, error))
         
         threading.Thread(target=wrapper, daemon=True).start()
+
+    def _async_engine(self):
+        """启用且安装了 httpx 时返回异步请求层，否则返回None"""
+        if self.settings.get('async_engine', True):
+            return self.steam_friends.async_client
+
+    def _run_async_task(self, task_coro, finish_func):
+        """在 Flet 的事件循环上运行协程任务，完成后与线程任务一样通过 run_thread 调用 finish_func，
+        避免读写存储、重新排序等阻塞操作卡住事件循环"""
+        async def wrapper():
+            try:
+                result = await task_coro()
+            except Exception as e:
+                self.page.run_thread(lambda error=str(e): finish_func(False, error))
+            else:
+                self.page.run_thread(lambda: finish_func(True, result))
+        
+        self.page.run_task(wrapper)
     
     def _validate_inputs(self, *required_inputs):
         """验证必需的输入字段"""
@@ -528,22 +265,27 @@ class SteamFriendsApp:
             bgcolor=ft.Colors.with_opacity(0.2, ft.Colors.BLUE_100)
         )
         self.status_text = ft.Text("就绪", size=14, weight=ft.FontWeight.W_500)
-        self.sort_ascending = True
-        self.sort_indicator = ft.Icon(ft.Icons.ARROW_UPWARD, size=16)
+        self.cache_stats_text = ft.Text("", size=11, color=ft.Colors.GREY_600)
+        self.sort_key, self.sort_ascending = 'bfd', True
+        self.sort_indicators = {key: ft.Icon(ft.Icons.ARROW_UPWARD, size=16, visible=key == 'bfd')
+                                for key in FriendsRepository.sort_keys}
+
+        def sortable_column(title, key):
+            return ft.DataColumn(
+                ft.Row([ft.Text(title, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700), self.sort_indicators[key]], spacing=5),
+                tooltip="点击排序", on_sort=lambda e: self._toggle_sort(key)
+            )
 
         # 创建数据表格（等分布局）
         self.data_table = ft.DataTable(
             columns=[
                 ft.DataColumn(ft.Checkbox()),
                 ft.DataColumn(ft.Text("头像", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700), numeric=True),
-                ft.DataColumn(ft.Text("昵称", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700)),
+                sortable_column("昵称", 'name'),
                 ft.DataColumn(ft.Text("Steam ID", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700)),
-                ft.DataColumn(ft.Text("状态", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700), numeric=True),
-                ft.DataColumn(
-                    ft.Row([ft.Text("成为好友时间", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700), self.sort_indicator], spacing=5),
-                    tooltip="点击排序", on_sort=lambda e: self._toggle_sort()
-                ),
-                ft.DataColumn(ft.Text("删除时间", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700)),
+                sortable_column("状态", 'is_friend'),
+                sortable_column("成为好友时间", 'bfd'),
+                sortable_column("删除时间", 'removed_time'),
                 ft.DataColumn(ft.Text("备注", weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700)),
             ],
             rows=[], expand=True, column_spacing=20,
@@ -560,6 +302,44 @@ class SteamFriendsApp:
         self.scroll_view = ft.Column([self.data_table], scroll=ft.ScrollMode.AUTO, 
                                    expand=True, horizontal_alignment=ft.CrossAxisAlignment.STRETCH)
 
+        # 分页控件
+        self.prev_page_button = ft.IconButton(ft.Icons.CHEVRON_LEFT, tooltip="上一页", on_click=lambda e: self._change_table_page(-1))
+        self.next_page_button = ft.IconButton(ft.Icons.CHEVRON_RIGHT, tooltip="下一页", on_click=lambda e: self._change_table_page(1))
+        self.page_label = ft.Text("", size=12, color=ft.Colors.GREY_700)
+        self.page_size_dropdown = ft.Dropdown(
+            value=str(self.page_size), width=110, dense=True, label="每页条数",
+            options=[ft.dropdown.Option(str(n)) for n in sorted({50, 100, 200, 500, self.page_size})],
+            on_change=self._change_page_size
+        )
+        # 筛选栏
+        self.filters = {}
+        self.search_input = ft.TextField(
+            hint_text="搜索昵称 / 备注 / SteamID", prefix_icon=ft.Icons.SEARCH, width=260, dense=True,
+            on_change=self._apply_filter
+        )
+        self.status_filter = ft.Dropdown(
+            value='all', width=120, dense=True, label="状态",
+            options=[ft.dropdown.Option('all', "全部"), ft.dropdown.Option('friend', "好友"),
+                     ft.dropdown.Option('removed', "已删除"), ft.dropdown.Option('banned', "有封禁")],
+            on_change=self._apply_filter
+        )
+        self.date_field_filter = ft.Dropdown(
+            value='friend_since', width=150, dense=True, label="日期",
+            options=[ft.dropdown.Option('friend_since', "成为好友时间"), ft.dropdown.Option('removed_time', "删除时间")],
+            on_change=self._apply_filter
+        )
+        self.date_from_input = ft.TextField(label="从", hint_text="YYYY-MM-DD", width=130, dense=True, on_change=self._apply_filter)
+        self.date_to_input = ft.TextField(label="到", hint_text="YYYY-MM-DD", width=130, dense=True, on_change=self._apply_filter)
+        self.filter_bar = ft.Row(
+            [self.search_input, self.status_filter, self.date_field_filter, self.date_from_input, self.date_to_input,
+             ft.IconButton(ft.Icons.CLEAR, tooltip="清除筛选", on_click=self._clear_filter)],
+            alignment=ft.MainAxisAlignment.CENTER, spacing=10
+        )
+        self.pagination_bar = ft.Row(
+            [self.prev_page_button, self.page_label, self.next_page_button, self.page_size_dropdown],
+            alignment=ft.MainAxisAlignment.CENTER, spacing=10
+        )
+
         # 创建按钮（带样式）
         def create_button(text, handler, color=ft.Colors.BLUE_500, width=150):
             return ft.ElevatedButton(
@@ -577,12 +357,23 @@ class SteamFriendsApp:
         self.save_settings_button = create_button("保存设置", self.save_current_settings, ft.Colors.GREEN_500)
         self.refresh_avatar_button = create_button("刷新头像", self.refresh_avatars)
         self.refresh_avatar_button.visible = False
+        self.export_csv_button = create_button("导出CSV", self.export_csv, ft.Colors.TEAL_500)
+        self.scan_bans_button = create_button("扫描封禁", self.scan_bans, ft.Colors.ORANGE_600)
+        self.diagnostics_button = create_button("诊断", self.show_diagnostics, ft.Colors.BLUE_GREY_500, 100)
         
         # 好友功能按钮
         self.query_user_button = create_button("查询用户", self.query_user_info, ft.Colors.PURPLE_500, 130)
         self.add_friend_button = create_button("添加好友", self.send_friend_request, ft.Colors.GREEN_600, 130)
         self.add_friend_button.disabled = True  # 初始状态禁用
         
+        # 增量更新复选框
+        self.incremental_checkbox = ft.Checkbox(
+            label="增量更新",
+            value=self.settings.get('incremental_refresh', True),
+            tooltip="只获取新增好友和资料过期的好友",
+            active_color=ft.Colors.BLUE_500
+        )
+        
         # 全选复选框
         self.select_all_checkbox = ft.Checkbox(
             label="全选",
@@ -626,9 +417,10 @@ class SteamFriendsApp:
                         ], spacing=15, alignment=ft.MainAxisAlignment.CENTER),
                         ft.Row([
                             self.update_button, self.delete_button, self.remove_friend_button, 
-                            self.refresh_avatar_button, self.save_settings_button
+                            self.refresh_avatar_button, self.scan_bans_button, self.export_csv_button, self.save_settings_button,
+                            self.diagnostics_button
                         ], spacing=15, alignment=ft.MainAxisAlignment.CENTER),
-                        ft.Row([self.select_all_checkbox], alignment=ft.MainAxisAlignment.CENTER),
+                        ft.Row([self.select_all_checkbox, self.incremental_checkbox], alignment=ft.MainAxisAlignment.CENTER),
                         # 好友功能区域（可折叠）
                         ft.Divider(),
                         ft.Container(
@@ -696,14 +488,16 @@ class SteamFriendsApp:
                             margin=ft.margin.symmetric(vertical=5)
                         ),
                         self.progress_bar,
-                        ft.Container(content=self.status_text, alignment=ft.alignment.center, padding=5)
+                        ft.Container(content=ft.Column([self.status_text, self.cache_stats_text], spacing=2,
+                                                       horizontal_alignment=ft.CrossAxisAlignment.CENTER),
+                                     alignment=ft.alignment.center, padding=5)
                     ], spacing=15),
                     padding=20, bgcolor=ft.Colors.WHITE,
                     border_radius=ft.border_radius.only(bottom_left=10, bottom_right=10)
                 ),
                 # 数据表格区域
                 ft.Container(
-                    content=ft.Column([self.scroll_view], expand=True),
+                    content=ft.Column([self.filter_bar, self.scroll_view, self.pagination_bar], expand=True),
                     expand=True, margin=ft.margin.only(top=10), padding=10,
                     bgcolor=ft.Colors.WHITE, border_radius=10,
                     border=ft.border.all(1, ft.Colors.BLUE_100)
@@ -733,6 +527,8 @@ class SteamFriendsApp:
         )
 
         self.page.add(gradient_bg)
+        self.friends.writer.on_flush = lambda pending: self.page.run_thread(lambda: self._finish_remark_flush(pending))
+        self.page.on_disconnect = lambda e: self.friends.flush()
         self.page.on_resize = lambda e: self.settings.update({
             'window_width': self.page.window_width, 'window_height': self.page.window_height
         })
@@ -746,6 +542,7 @@ class SteamFriendsApp:
     def save_current_settings(self, e=None):
         """保存当前设置"""
         settings = {
+            **self.settings,
             'api_key': self.api_key_input.value,
             'steam_id': self.steam_id_input.value,
             'proxy': self.proxy_input.value,
@@ -757,9 +554,77 @@ class SteamFriendsApp:
         self.status_text.value = "设置已保存" if success else "保存设置失败"
         self.page.update()
 
+    def show_diagnostics(self, e=None):
+        """诊断面板：各类请求、存储读写和表格渲染的次数、耗时、字节数与状态码"""
+        header = lambda text: ft.DataColumn(ft.Text(text, weight=ft.FontWeight.BOLD, color=ft.Colors.BLUE_700))
+        table = ft.DataTable(columns=[header(t) for t in ("指标", "标签", "次数", "平均ms", "P95 ms", "最大ms", "字节/条目", "状态码")],
+                             rows=[], column_spacing=14, data_row_min_height=32, data_row_max_height=48)
+        summary = ft.Text("", size=12, color=ft.Colors.GREY_700)
+        
+        def refresh(e=None):
+            rows = metrics.snapshot()
+            table.rows = [ft.DataRow([ft.DataCell(ft.Text(str(value), size=12)) for value in (
+                row['name'], ', '.join(f"{k}={v}" for k, v in row['labels'].items()), row['count'], row['avg_ms'],
+                row['p95_ms'], row['max_ms'], row['bytes'] or row['items'],
+                ' '.join(f"{k}:{v}" for k, v in row['statuses'].items())
+            )]) for row in rows]
+            summary.value = ("指标记录已开启" if metrics.enabled else "指标记录已关闭") + \
+                f"，自 {datetime.fromtimestamp(metrics.started_at).strftime('%H:%M:%S')} 起共 {len(rows)} 项"
+            self.page.update()
+        
+        def toggle(e):
+            metrics.enabled = self.settings['metrics_enabled'] = e.control.value
+            refresh()
+        
+        def export(fmt):
+            path = 'metrics.prom' if fmt == 'prometheus' else 'metrics.jsonl'
+            try:
+                metrics.export(path, fmt)
+                summary.value = f"已导出到 {path}"
+            except Exception as ex:
+                summary.value = f"导出失败: {ex}"
+            self.page.update()
+        
+        def reset(e):
+            metrics.reset()
+            refresh()
+        
+        def close(e):
+            self.page.dialog.open = False
+            self.page.update()
+        
+        dialog = ft.AlertDialog(
+            title=ft.Text("诊断"),
+            content=ft.Column([
+                ft.Switch(label="记录指标", value=metrics.enabled, on_change=toggle), summary,
+                ft.Row([table], scroll=ft.ScrollMode.AUTO)
+            ], scroll=ft.ScrollMode.AUTO, width=860, height=460),
+            actions=[
+                ft.TextButton("刷新", on_click=refresh),
+                ft.TextButton("导出JSON行", on_click=lambda e: export('jsonl')),
+                ft.TextButton("导出Prometheus", on_click=lambda e: export('prometheus')),
+                ft.TextButton("重置", on_click=reset),
+                ft.TextButton("关闭", on_click=close)
+            ],
+            actions_alignment=ft.MainAxisAlignment.END
+        )
+        
+        self.page.dialog = dialog
+        dialog.open = True
+        refresh()
+
+    def export_csv(self, e=None):
+        """导出好友数据为CSV"""
+        try:
+            count = self.steam_friends.export_friends_csv()
+            self.status_text.value = f"已导出 {count} 条记录到 friends_data.csv"
+        except Exception as ex:
+            self.status_text.value = f"导出失败: {str(ex)}"
+        self.page.update()
+
     def load_existing_data(self):
         try:
-            data = self.steam_friends.read_friends_data()
+            data = self.friends.rows
             has_data = bool(data)
             if has_data:
                 self._update_data_table()
@@ -771,35 +636,33 @@ class SteamFriendsApp:
             self.refresh_avatar_button.visible = False
             self.page.update()
 
-    def _toggle_sort(self):
-        """切换排序方向"""
-        self.sort_ascending = not self.sort_ascending
+    def _toggle_sort(self, key='bfd'):
+        """切换排序列；点击当前排序列时切换排序方向"""
+        if key == self.sort_key:
+            self.sort_ascending = not self.sort_ascending
+        else:
+            self.sort_key, self.sort_ascending = key, True
         
         # 更新排序指示器
-        if self.sort_ascending:
-            self.sort_indicator.name = ft.Icons.ARROW_UPWARD
-        else:
-            self.sort_indicator.name = ft.Icons.ARROW_DOWNWARD
+        for column, indicator in self.sort_indicators.items():
+            indicator.visible = column == self.sort_key
+            indicator.name = ft.Icons.ARROW_UPWARD if self.sort_ascending else ft.Icons.ARROW_DOWNWARD
         
-        # 重新加载并排序数据
+        # 使用缓存的排序结果重新渲染
         self._update_data_table()
     
     def _update_remark(self, steamid, new_remark):
-        """更新好友备注"""
-        try:
-            data = self.steam_friends.read_friends_data()
-            if not data: return
-            
-            for item in data:
-                if item['steamid'] == steamid and item.get('remark', '') != new_remark:
-                    item['remark'] = new_remark
-                    self.steam_friends.save_friends_data(data)
-                    self.status_text.value = f"已更新 {item['name']} 的备注"
-                    self.page.update()
-                    break
-        except Exception as e:
-            self.status_text.value = f"更新备注失败: {str(e)}"
-            self.page.update()
+        """更新好友备注（内存立即生效，停止输入或离开输入框后写入存储）"""
+        item = self.friends.get(steamid)
+        if not item or item.get('remark', '') == new_remark: return
+        self.friends.update_deferred(steamid, remark=new_remark)
+
+    def _finish_remark_flush(self, pending):
+        """备注写入存储后更新状态栏"""
+        names = [self.friends.get(sid)['name'] for sid in pending if self.friends.get(sid)]
+        if not names: return
+        self.status_text.value = f"已更新 {names[0]} 的备注" if len(names) == 1 else f"已更新 {len(names)} 个好友的备注"
+        self.page.update()
 
     def _open_steam_profile(self, steamid):
         """打开Steam个人主页"""
@@ -815,128 +678,113 @@ class SteamFriendsApp:
 
     def _toggle_friend_selection(self, steamid, is_selected):
         """切换好友选择状态"""
-        self.selected_friends[steamid] = is_selected
+        self.friends.set_selected(steamid, is_selected)
         # 更新全选复选框状态
-        data = self.steam_friends.read_friends_data()
-        if data:
-            all_selected = all(self.selected_friends.get(item['steamid'], False) for item in data)
-            self.select_all_checkbox.value = all_selected
-            self.page.update()
+        self.select_all_checkbox.value = self.friends.all_selected
+        self.page.update()
 
     def _toggle_select_all(self, e):
         """切换全选状态"""
-        data = self.steam_friends.read_friends_data()
-        if not data: return
+        if not len(self.friends): return
         
-        is_selected = e.control.value
-        for item in data:
-            self.selected_friends[item['steamid']] = is_selected
-        
-        # 重新渲染数据表格以更新复选框状态
+        with self.table_lock:
+            self.friends.select_all(e.control.value, [row['steamid'] for row in self._table_rows()] if self.filters else None)
+            # 只修补当前页的复选框状态
+            self._refresh_visible_rows()
+
+    def _table_rows(self):
+        """当前排序下要显示的行，有筛选条件时只返回匹配的行"""
+        if not self.filters:
+            return self.friends.sorted_rows(self.sort_key, self.sort_ascending)
+        return self.friends.search(key=self.sort_key, ascending=self.sort_ascending, **self.filters)
+
+    def _apply_filter(self, e=None):
+        """根据筛选栏更新筛选条件并回到第一页；日期未输入完整时忽略该项"""
+        filters = {}
+        if self.search_input.value and self.search_input.value.strip():
+            filters['text'] = self.search_input.value.strip()
+        if self.status_filter.value != 'all':
+            filters['status'] = self.status_filter.value
+        field = self.date_field_filter.value or 'friend_since'
+        for key, control, offset in (('start', self.date_from_input, 0), ('end', self.date_to_input, 1)):
+            try:
+                day = datetime.strptime((control.value or '').strip(), '%Y-%m-%d') + timedelta(days=offset)
+            except ValueError:
+                continue
+            filters[key] = int(day.timestamp()) if field == 'friend_since' else day.strftime('%Y-%m-%d %H:%M:%S')
+        if 'start' in filters or 'end' in filters:
+            filters['date_field'] = field
+        
+        self.filters = filters
+        self.table_page = 0
         self._update_data_table()
 
+    def _clear_filter(self, e=None):
+        self.search_input.value = self.date_from_input.value = self.date_to_input.value = ''
+        self.status_filter.value = 'all'
+        self._apply_filter()
+
     def _update_data_table(self):
-        """更新数据表格"""
-        self.data_table.rows.clear()
-        data = self.steam_friends.read_friends_data()
-        if not data: return self.page.update()
-        
-        # 排序数据
-        try:
-            data.sort(key=lambda x: datetime.strptime(x['bfd'], '%Y-%m-%d %H:%M:%S'), 
-                     reverse=not self.sort_ascending)
-        except: pass
-        
-        for item in data:
-            # 选择复选框
-            select_checkbox = ft.Checkbox(
-                value=self.selected_friends.get(item['steamid'], False),
-                on_change=lambda e, sid=item['steamid']: self._toggle_friend_selection(sid, e.control.value)
-            )
-            
-            # 头像 - 居中显示
-            avatar = ft.Container(
-                content=ft.Image(
-                    src=item['avatar'], 
-                    width=36, 
-                    height=36, 
-                    fit=ft.ImageFit.COVER, 
-                    border_radius=18
-                ),
-                width=40, 
-                height=40, 
-                border_radius=20, 
-                clip_behavior=ft.ClipBehavior.ANTI_ALIAS,
-                bgcolor=ft.Colors.BLUE_50,
-                alignment=ft.alignment.center
-            )
-            
-            # 昵称 - 加粗显示并居中
-            name_text = ft.Text(
-                item['name'], 
-                weight=ft.FontWeight.W_500,
-                size=14,
-                text_align=ft.TextAlign.CENTER,
-                width=120
-            )
+        """更新数据表格（只为当前页的好友绑定行控件）"""
+        with self.table_lock:
+            started = metrics.start()
+            data = self._table_rows()
             
-            # Steam ID - 超链接
-            steam_id_text = ft.TextButton(
-                text=item['steamid'], 
-                style=ft.ButtonStyle(
-                    color=ft.Colors.BLUE_600,
-                    text_style=ft.TextStyle(
-                        font_family="monospace",
-                        size=12,
-                        decoration=ft.TextDecoration.UNDERLINE
-                    )
-                ),
-                on_click=lambda e, sid=item['steamid']: self._open_steam_profile(sid)
-            )
+            # 分页
+            page_count = max(1, -(-len(data) // self.page_size))
+            self.table_page = min(max(self.table_page, 0), page_count - 1)
+            start = self.table_page * self.page_size
+            visible = data[start:start + self.page_size]
             
-            # 好友状态 - 文本显示并居中
-            status_text = ft.Text(
-                item['is_friend'], 
-                size=12,
-                weight=ft.FontWeight.W_500,
-                text_align=ft.TextAlign.CENTER,
-                width=60
-            )
-            
-            # 时间显示 - 格式化并居中
-            bfd_text = ft.Text(item['bfd'], size=12, text_align=ft.TextAlign.CENTER, width=120) if item['bfd'] else ft.Text("-", size=12, text_align=ft.TextAlign.CENTER, width=120)
-            removed_text = ft.Text(item['removed_time'], size=12, text_align=ft.TextAlign.CENTER, width=120) if item['removed_time'] else ft.Text("-", size=12, text_align=ft.TextAlign.CENTER, width=120)
-            
-            # 备注 - 美化输入框
-            remark = ft.TextField(
-                value=item['remark'] or '', 
-                width=200, 
-                height=32, 
-                dense=True,
-                border=ft.InputBorder.UNDERLINE,
-                filled=True,
-                text_size=12,
-                hint_text="点击添加备注...",
-                bgcolor=ft.Colors.with_opacity(0.05, ft.Colors.BLUE_50),
-                content_padding=ft.padding.only(left=8, right=8, top=8, bottom=4),
-                border_color=ft.Colors.BLUE_200,
-                focused_border_color=ft.Colors.BLUE_500,
-                cursor_color=ft.Colors.BLUE_500,
-                on_change=lambda e, sid=item['steamid']: self._update_remark(sid, e.control.value)
-            )
+            # 按steamid复用行控件：仍在当前页的行只修补变化的单元格，移出的行控件回收给新出现的行
+            visible_ids = {item['steamid'] for item in visible}
+            for steamid in [sid for sid in self.row_cache if sid not in visible_ids]:
+                self.free_row_views.append(self.row_cache.pop(steamid))
+            rows = []
+            for item in visible:
+                view = self.row_cache.get(item['steamid'])
+                if view is None:
+                    view = self.free_row_views.pop() if self.free_row_views else FriendRowView(self)
+                    self.row_cache[item['steamid']] = view
+                view.bind(item, self.friends.is_selected(item['steamid']))
+                rows.append(view.row)
+            if [id(row) for row in rows] != [id(row) for row in self.data_table.rows]:
+                self.data_table.rows = rows
             
-            self.data_table.rows.append(ft.DataRow([
-                ft.DataCell(select_checkbox),
-                ft.DataCell(avatar),
-                ft.DataCell(name_text),
-                ft.DataCell(steam_id_text),
-                ft.DataCell(status_text),
-                ft.DataCell(bfd_text),
-                ft.DataCell(removed_text),
-                ft.DataCell(remark)
-            ]))
-        
-        self.page.update()
+            self.page_label.value = f"第 {self.table_page + 1} / {page_count} 页，共 {len(data)} 条" + (
+                f"（筛选自 {len(self.friends)} 条）" if self.filters else "")
+            self.prev_page_button.disabled = self.table_page == 0
+            self.next_page_button.disabled = self.table_page >= page_count - 1
+            self.page.update()
+            metrics.observe('ui_render', started, items=len(rows))
+
+    def _refresh_visible_rows(self):
+        """不重新排序分页，仅按内存数据修补当前页各行"""
+        with self.table_lock:
+            for steamid, view in self.row_cache.items():
+                item = self.friends.get(steamid)
+                if item:
+                    view.bind(item, self.friends.is_selected(steamid))
+            self.page.update()
+
+    def _reload_table(self):
+        """从存储重新加载好友数据并重新渲染表格"""
+        with self.table_lock:
+            self.friends.reload()
+            self._update_data_table()
+
+    def _change_table_page(self, delta):
+        """翻页"""
+        with self.table_lock:
+            self.table_page += delta
+            self._update_data_table()
+
+    def _change_page_size(self, e):
+        """修改每页显示条数"""
+        self.page_size = int(e.control.value)
+        self.settings['table_page_size'] = self.page_size
+        self.table_page = 0
+        self._update_data_table()
 
     def update_friends(self, e):
         """更新好友列表"""
@@ -946,27 +794,68 @@ class SteamFriendsApp:
         # 禁用按钮并显示进度
         self._disable_buttons([self.update_button, self.delete_button, self.refresh_avatar_button])
         self._show_progress("正在更新好友列表...")
+        self.refresh_batches_shown = 0
         
-        def update_task():
+        def prepare():
             self._setup_steam_api()
-            return self.steam_friends.update_friends_list()
+            self.friends.flush()  # 整体刷新会重写所有行，先写入待保存的备注
+            self.settings['incremental_refresh'] = self.incremental_checkbox.value
+            return self.incremental_checkbox.value, self.settings.get('summary_max_age_hours', 24) * 3600
+        
+        # 每批预览都交给线程池处理：合并、重新排序和渲染表格需要持有表格锁，不能在事件循环中执行
+        def on_batch(*progress):
+            self.page.run_thread(lambda: self._show_refresh_batch(*progress))
+        
+        def update_task():
+            return self.steam_friends.update_friends_list(*prepare(), on_batch=on_batch)
+        
+        async def update_task_async():
+            incremental, max_age = await asyncio.to_thread(prepare)  # prepare 会写入待保存的备注
+            return await self._async_engine().update_friends_list(incremental, max_age, on_batch=on_batch)
         
         def finish_update(success, result):
-            self._enable_buttons([self.update_button, self.delete_button, self.refresh_avatar_button])
-            self._hide_progress()
-            
-            if success:
-                self.status_text.value = f"更新完成，共 {len(result)} 条记录"
-                self._update_data_table()
-                self.refresh_avatar_button.visible = True
-            else:
-                self.status_text.value = f"更新失败: {result}"
-            self.page.update()
+            # 与批次预览互斥：恢复按钮后到达的批次不会再合并进已重新加载的数据
+            with self.table_lock:
+                self._enable_buttons([self.update_button, self.delete_button, self.refresh_avatar_button])
+                self._hide_progress()
+                
+                if success:
+                    stats = self.steam_friends.last_refresh_stats
+                    self.status_text.value = f"更新完成，共 {len(result)} 条记录（获取 {stats['fetched']} 个好友资料，跳过 {stats['skipped']} 个）"
+                    self._reload_table()
+                    self.refresh_avatar_button.visible = True
+                else:
+                    self.status_text.value = f"更新失败: {result}"
+                    self._reload_table()  # 丢弃未写入存储的预览行，避免在其上编辑的备注无处保存
+                self.page.update()
         
-        self._run_thread_task(update_task, finish_update)
+        if self._async_engine():
+            self._run_async_task(update_task_async, finish_update)
+        else:
+            self._run_thread_task(update_task, finish_update)
 
 
 
+    def _finish_avatar_download(self, count):
+        """后台头像下载完成后刷新表格"""
+        stats = self.steam_friends.avatar_cache.stats()
+        self.status_text.value = (f"头像下载完成，更新 {count} 个头像（缓存命中 {stats['hits']} / "
+                                  f"未命中 {stats['misses']} / 淘汰 {stats['evictions']}）")
+        if count:
+            self._reload_table()
+        else:
+            self.page.update()
+
+    def _show_refresh_batch(self, done, total, records):
+        """刷新过程中每收到一批资料：合并进表格并推进进度条"""
+        with self.table_lock:
+            if not self.update_button.disabled: return  # 刷新已结束，迟到的批次不再显示
+            self.friends.merge_preview(records)
+            self.refresh_batches_shown = max(done, self.refresh_batches_shown)
+            self.progress_bar.value = self.refresh_batches_shown / total
+            self.status_text.value = f"正在更新好友列表... 已获取 {self.refresh_batches_shown}/{total} 批资料"
+            self._update_data_table()
+
     def delete_non_friends(self, e):
         """删除非好友记录"""
         # 禁用按钮并显示进度
@@ -982,7 +871,7 @@ class SteamFriendsApp:
             
             if success:
                 self.status_text.value = f"已删除非好友记录，剩余 {len(result)} 条记录"
-                self._update_data_table()
+                self._reload_table()
             else:
                 self.status_text.value = f"删除失败: {result}"
             self.page.update()
@@ -992,7 +881,7 @@ class SteamFriendsApp:
     def remove_selected_friends(self, e):
         """删除选中的好友"""
         # 获取选中的好友
-        selected_steamids = [steamid for steamid, is_selected in self.selected_friends.items() if is_selected]
+        selected_steamids = self.friends.selected_ids()
         
         if not selected_steamids:
             self.status_text.value = "请先选择要删除的好友"
@@ -1005,50 +894,35 @@ class SteamFriendsApp:
                 for btn in [self.update_button, self.delete_button, self.remove_friend_button, self.refresh_avatar_button]:
                     btn.disabled = True
                 self.progress_bar.visible = True
+                self.progress_bar.value = 0
                 self.status_text.value = f"正在删除 {len(selected_steamids)} 个好友..."
                 self.page.update()
                 
                 def delete_task():
                     try:
-                        self.steam_friends.steam_web_api = self.api_key_input.value
-                        self.steam_friends.steam_id = self.steam_id_input.value
-                        self.steam_friends.set_proxy(self.proxy_input.value)
-                        
-                        success_count = 0
-                        failed_friends = []
+                        self._setup_steam_api()
                         
-                        for steamid in selected_steamids:
-                            try:
-                                if self.steam_friends.remove_friend(steamid):
-                                    success_count += 1
-                                else:
-                                    failed_friends.append(steamid)
-                            except Exception as error:
-                                failed_friends.append(f"{steamid} ({str(error)})")
+                        started, last_update = time.time(), [0]
+                        def on_progress(done, total, steamid, error):
+                            # 限制界面刷新频率，最后一项总是刷新
+                            if done < total and time.time() - last_update[0] < 0.2: return
+                            last_update[0] = time.time()
+                            eta = (time.time() - started) / done * (total - done)
+                            self.page.run_thread(lambda: self._show_remove_progress(done, total, eta))
                         
-                        # 更新本地数据
-                        if success_count > 0:
-                            data = self.steam_friends.read_friends_data()
-                            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                            
-                            for item in data:
-                                if item['steamid'] in selected_steamids and item['is_friend'] == '✅':
-                                    item['is_friend'] = '❌'
-                                    item['removed_time'] = now
-                            
-                            self.steam_friends.save_friends_data(data)
+                        removed, failed_friends = self.steam_friends.remove_friends(selected_steamids, on_progress)
                         
                         # 清空选择
-                        self.selected_friends.clear()
+                        self.friends.clear_selection()
                         
                         if failed_friends:
-                            message = f"成功删除 {success_count} 个好友，失败 {len(failed_friends)} 个：{', '.join(failed_friends[:3])}{'...' if len(failed_friends) > 3 else ''}"
+                            message = f"成功删除 {len(removed)} 个好友，失败 {len(failed_friends)} 个：{', '.join(failed_friends[:3])}{'...' if len(failed_friends) > 3 else ''}"
                         else:
-                            message = f"成功删除 {success_count} 个好友"
+                            message = f"成功删除 {len(removed)} 个好友"
                         
                         self.page.run_thread(lambda: self._finish_remove_friend(True, message))
                     except Exception as e:
-                        self.page.run_thread(lambda: self._finish_remove_friend(False, f"删除好友失败: {e}"))
+                        self.page.run_thread(lambda error=e: self._finish_remove_friend(False, f"删除好友失败: {error}"))
                 
                 threading.Thread(target=delete_task, daemon=True).start()
             
@@ -1076,14 +950,20 @@ class SteamFriendsApp:
         dialog.open = True
         self.page.update()
 
+    def _show_remove_progress(self, done, total, eta):
+        """显示删除进度和预计剩余时间"""
+        self.progress_bar.value = done / total
+        self.status_text.value = f"正在删除好友 {done}/{total}，预计剩余 {eta:.0f} 秒"
+        self.page.update()
+
     def _finish_remove_friend(self, success, message):
         """完成删除好友后的UI处理"""
         for btn in [self.update_button, self.delete_button, self.remove_friend_button, self.refresh_avatar_button]:
             btn.disabled = False
         self.progress_bar.visible = False
         self.status_text.value = message
-        if success:
-            self._update_data_table()
+        # 删除结果已逐个写入存储，失败时也需要重新加载已完成的部分
+        self._reload_table()
         self.page.update()
 
     def refresh_avatars(self, e):
@@ -1092,22 +972,16 @@ class SteamFriendsApp:
         self._show_progress("正在刷新头像...")
         
         def refresh_task():
-            data = self.steam_friends.read_friends_data()
-            if not data:
+            self._setup_steam_api()
+            if not len(self.friends):
                 return "没有数据需要刷新"
-            
-            count = 0
-            for item in data:
-                if item['steamid']:
-                    url = f"https://avatars.akamai.steamstatic.com/{item['steamid']}_full.jpg"
-                    new_path = self.steam_friends.download_avatar(url, item['steamid'])
-                    if new_path != item['avatar']:
-                        item['avatar'], count = new_path, count + 1
-            
-            if count:
-                self.steam_friends.save_friends_data(data)
-            
-            return f"已刷新 {count} 个头像"
+            return f"已刷新 {self.steam_friends.refresh_avatars()} 个头像"
+        
+        async def refresh_task_async():
+            self._setup_steam_api()
+            if not len(self.friends):
+                return "没有数据需要刷新"
+            return f"已刷新 {await self._async_engine().refresh_avatars()} 个头像"
         
         def finish_refresh(success, result):
             self._enable_buttons([self.refresh_avatar_button])
@@ -1115,13 +989,42 @@ class SteamFriendsApp:
             
             if success:
                 self.status_text.value = result
-                self._update_data_table()
+                self._reload_table()
             else:
                 self.status_text.value = f"刷新失败: {result}"
             self.page.update()
         
-        self._run_thread_task(refresh_task, finish_refresh)
+        if self._async_engine():
+            self._run_async_task(refresh_task_async, finish_refresh)
+        else:
+            self._run_thread_task(refresh_task, finish_refresh)
     
+    def scan_bans(self, e):
+        """批量扫描好友封禁记录"""
+        if not self._validate_inputs(self.api_key_input, self.steam_id_input):
+            return
+        
+        self._disable_buttons([self.scan_bans_button])
+        self._show_progress("正在扫描好友封禁记录...")
+        
+        def scan_task():
+            self._setup_steam_api()
+            return self.steam_friends.scan_friend_bans(self.settings.get('ban_scan_ttl_hours', 24) * 3600)
+        
+        def finish_scan(success, result):
+            self._enable_buttons([self.scan_bans_button])
+            self._hide_progress()
+            
+            if success:
+                scanned, banned = result
+                self.status_text.value = f"已扫描 {scanned} 个好友，其中 {banned} 个有封禁记录" if scanned else "封禁记录均在有效期内，无需重新扫描"
+                self._reload_table()
+            else:
+                self.status_text.value = f"扫描失败: {result}"
+            self.page.update()
+        
+        self._run_thread_task(scan_task, finish_scan)
+
     def query_user_info(self, e):
         """查询用户信息"""
         if not self._validate_inputs(self.api_key_input, self.steam_id_input, self.friend_code_input):
@@ -1131,9 +1034,21 @@ class SteamFriendsApp:
         self._disable_buttons([self.query_user_button])
         self._show_progress("正在查询用户信息...")
         
+        # 资料卡头像在任务中下载，显示时直接使用本地路径
         def query_task():
             self._setup_steam_api()
-            return self.steam_friends.get_user_info(self.friend_code_input.value)
+            user_info = self.steam_friends.get_user_info(self.friend_code_input.value)
+            if user_info.get('steamid') and user_info.get('avatarfull'):
+                user_info['avatar_path'] = self.steam_friends.download_avatar(user_info['avatarfull'], user_info['steamid'])
+            return user_info
+        
+        async def query_task_async():
+            self._setup_steam_api()
+            engine = self._async_engine()
+            user_info = await engine.get_user_info(self.friend_code_input.value)
+            if user_info.get('steamid') and user_info.get('avatarfull'):
+                user_info['avatar_path'] = await engine.download_profile_avatar(user_info['avatarfull'], user_info['steamid'])
+            return user_info
         
         def finish_query_user(success, result):
             self._enable_buttons([self.query_user_button])
@@ -1149,7 +1064,10 @@ class SteamFriendsApp:
                 self.add_friend_button.disabled = True
             self.page.update()
         
-        self._run_thread_task(query_task, finish_query_user)
+        if self._async_engine():
+            self._run_async_task(query_task_async, finish_query_user)
+        else:
+            self._run_thread_task(query_task, finish_query_user)
     
     def _create_ban_status_badge(self, ban_info):
         """创建封禁状态标签"""
@@ -1288,26 +1206,16 @@ class SteamFriendsApp:
         self.current_user_info = user_info
         user_name = user_info.get('personaname', '未知用户')
         user_status = "在线" if user_info.get('personastate', 0) > 0 else "离线"
-        user_avatar = user_info.get('avatarfull', '')
+        user_avatar = user_info.get('avatar_path') or user_info.get('avatarfull', '')  # 查询任务已下载到本地缓存
         user_profile_url = f"https://steamcommunity.com/profiles/{user_info.get('steamid', '')}"
         game_count = user_info.get('game_count', 0)
         ban_info = user_info.get('ban_info')
         recent_game = user_info.get('recent_game')
         
-        # 处理头像URL，确保有效并下载到本地缓存
+        # 处理头像URL，确保有效
         if not user_avatar or user_avatar == '':
             user_avatar = 'https://avatars.steamstatic.com/fef49e7fa7e1997310d705b2a6158ff8dc1cdfeb.jpg'  # 默认头像
         
-        # 下载头像到本地缓存
-        steamid = user_info.get('steamid', '')
-        if steamid:
-            try:
-                user_avatar = self.steam_friends.download_avatar(user_avatar, steamid)
-            except Exception as e:
-                print(f"下载头像失败: {e}")
-                # 如果下载失败，使用默认头像
-                user_avatar = 'https://avatars.steamstatic.com/fef49e7fa7e1997310d705b2a6158ff8dc1cdfeb.jpg'
-        
         # 创建正方形统计框
         def create_square_badge(text, color, bg_color):
             return ft.Container(
@@ -0,0 +1,2002 @@
+"""Steam好友管理工具核心：Steam Web API 请求、好友数据存储、头像缓存与指标，不依赖 Flet
+
+图形界面（main.py）与无界面命令行（headless.py）共用本模块
+"""
+import requests
+import json
+import re
+import csv
+import sqlite3
+from datetime import datetime
+import os
+import threading
+import hashlib
+import time
+import atexit
+import random
+import asyncio
+import tempfile
+import bisect
+from contextlib import contextmanager, nullcontext
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed
+from urllib.parse import urlparse, urlencode
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # 未安装 httpx 时使用线程 + requests 的同步实现
+    httpx = None
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+_file_locks, _file_locks_guard = {}, threading.Lock()
+
+
+@contextmanager
+def atomic_open(path, mode='w', durable=True, **kwargs):
+    """原子写入文件：先写入同目录的临时文件并 fsync，再用 os.replace 替换目标文件
+    
+    写入过程中崩溃或出错时目标文件保持原样；同一路径的写入者通过文件锁串行执行。
+    durable=False 用于可重新下载的缓存文件：不 fsync、不加锁，只保证读者不会看到写了一半的文件
+    """
+    path = os.path.abspath(path)
+    if durable:
+        with _file_locks_guard:
+            lock = _file_locks.setdefault(path, threading.Lock())
+    else:
+        lock = nullcontext()
+    with lock:
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with open(fd, mode, **kwargs) as f:
+                yield f
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try: os.remove(tmp_path)
+            except OSError: pass
+            raise
+
+
+_held_locks, _held_locks_guard = {}, threading.Lock()
+
+
+class LockFile:
+    """独占锁文件：同一数据目录同时只允许一个进程刷新，进程退出（包括崩溃）后锁由系统自动释放
+    
+    同一进程内可重入：无界面守护进程持有锁期间，其中的刷新再次获取同一个锁不会失败
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.held = False
+
+    def acquire(self):
+        """取得锁返回 True，已被其他进程持有返回 False"""
+        with _held_locks_guard:
+            entry = _held_locks.get(self.path)
+            if entry:
+                entry['count'] += 1
+                self.held = True
+                return True
+            file = open(self.path, 'a+')
+            try:
+                if os.name == 'nt':
+                    import msvcrt
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                return False
+            file.seek(0)
+            file.truncate()
+            file.write(f"{os.getpid()}\n")
+            file.flush()
+            _held_locks[self.path] = {'file': file, 'count': 1}
+            self.held = True
+            return True
+
+    def release(self):
+        with _held_locks_guard:
+            if not self.held: return
+            self.held = False
+            entry = _held_locks[self.path]
+            entry['count'] -= 1
+            if entry['count']: return
+            del _held_locks[self.path]
+            file = entry['file']
+            if os.name == 'nt':
+                import msvcrt
+                file.seek(0)
+                try: msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+                except OSError: pass
+            file.close()
+
+
+class Metrics:
+    """轻量指标：按名称和标签记录次数、耗时、字节数、条目数和状态码
+    
+    关闭时 start() 返回 None，observe() 立即返回，除一次属性判断外没有额外开销
+    """
+    def __init__(self, enabled=False, reservoir=512):
+        self.enabled, self.reservoir = enabled, reservoir
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.series = {}  # (名称, 标签) -> 统计
+            self.started_at = time.time()
+
+    def start(self):
+        """开始计时，关闭时返回 None"""
+        return time.perf_counter() if self.enabled else None
+
+    def observe(self, name, started, status=None, nbytes=0, items=0, **labels):
+        """记录一次操作；started 为 start() 的返回值，标签 url 会转换为接口名 endpoint"""
+        if started is None: return
+        duration = time.perf_counter() - started
+        if 'url' in labels:
+            labels['endpoint'] = endpoint_name(labels.pop('url'))
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            entry = self.series.get(key)
+            if entry is None:
+                entry = self.series[key] = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0, 'items': 0,
+                                            'statuses': {}, 'recent': deque(maxlen=self.reservoir)}
+            entry['count'] += 1
+            entry['seconds'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['bytes'] += nbytes
+            entry['items'] += items
+            entry['recent'].append(duration)
+            if status is not None:
+                entry['statuses'][str(status)] = entry['statuses'].get(str(status), 0) + 1
+
+    def _collect(self):
+        """按名称和标签排序返回 (名称, 标签, 统计副本, 排序后的最近耗时)"""
+        with self.lock:
+            items = [(name, dict(labels), dict(entry, statuses=dict(entry['statuses'])), sorted(entry['recent']))
+                     for (name, labels), entry in self.series.items()]
+        return sorted(items, key=lambda item: (item[0], sorted(item[1].items())))
+
+    @staticmethod
+    def _quantile(recent, q):
+        return recent[min(len(recent) - 1, int(q * len(recent)))]
+
+    def snapshot(self):
+        """返回各项指标的汇总（耗时单位为毫秒，分位数基于最近的若干次记录）"""
+        return [{
+            'name': name, 'labels': labels, 'count': entry['count'],
+            'avg_ms': round(entry['seconds'] / entry['count'] * 1000, 2),
+            'p50_ms': round(self._quantile(recent, 0.5) * 1000, 2), 'p95_ms': round(self._quantile(recent, 0.95) * 1000, 2),
+            'max_ms': round(entry['max'] * 1000, 2), 'total_ms': round(entry['seconds'] * 1000, 2),
+            'bytes': entry['bytes'], 'items': entry['items'], 'statuses': entry['statuses']
+        } for name, labels, entry, recent in self._collect()]
+
+    def to_jsonl(self):
+        now = int(time.time())
+        return ''.join(json.dumps({'time': now, **row}, ensure_ascii=False) + '\n' for row in self.snapshot())
+
+    def to_prometheus(self):
+        """Prometheus 文本格式：耗时为 summary，字节数、条目数和状态码为 counter"""
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        def fmt(labels, **extra):
+            pairs = {**labels, **extra}
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs.items()) + '}' if pairs else ''
+        
+        # 同一指标族的样本必须连续出现，先按指标族收集，再在各自的 TYPE 行之后输出
+        families = {}
+        def add(family, kind, line):
+            families.setdefault(family, (kind, []))[1].append(line)
+        
+        for name, labels, entry, recent in self._collect():
+            metric = 'steam_friends_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+            for q in (0.5, 0.95):
+                add(f'{metric}_seconds', 'summary', f"{metric}_seconds{fmt(labels, quantile=q)} {self._quantile(recent, q):.6f}")
+            add(f'{metric}_seconds', 'summary', f"{metric}_seconds_sum{fmt(labels)} {entry['seconds']:.6f}")
+            add(f'{metric}_seconds', 'summary', f"{metric}_seconds_count{fmt(labels)} {entry['count']}")
+            if entry['bytes']: add(f'{metric}_bytes_total', 'counter', f"{metric}_bytes_total{fmt(labels)} {entry['bytes']}")
+            if entry['items']: add(f'{metric}_items_total', 'counter', f"{metric}_items_total{fmt(labels)} {entry['items']}")
+            for status, count in entry['statuses'].items():
+                add(f'{metric}_status_total', 'counter', f"{metric}_status_total{fmt(labels, status=status)} {count}")
+        
+        lines = []
+        for family, (kind, samples) in families.items():
+            lines += [f'# TYPE {family} {kind}'] + samples
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, fmt='jsonl'):
+        """导出指标：jsonl 追加一次快照，prometheus 原子覆盖写入（可供 node_exporter 的 textfile 采集）"""
+        if fmt == 'prometheus':
+            with atomic_open(path, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+        else:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(self.to_jsonl())
+        return path
+
+
+metrics = Metrics()  # 全局指标，由设置 metrics_enabled 开启
+
+
+def endpoint_name(url):
+    """取 Steam Web API 的接口名（如 GetFriendList），其他地址取主机名"""
+    parts = [p for p in urlparse(url).path.split('/') if p]
+    for part in parts:
+        if part.startswith('Get') or part in ('RemoveFriend', 'AddFriend'):
+            return part
+    return urlparse(url).hostname or ''
+
+
+class SettingsManager:
+    def __init__(self):
+        self.settings_file = 'steam_settings.json'
+        self.defaults = {
+            'api_key': '', 'steam_id': '', 'proxy': '',
+            'window_width': 900, 'window_height': 700,
+            'max_workers': 4, 'avatar_workers': 8, 'avatar_cache_mb': 200,
+            'table_page_size': 100, 'ban_scan_ttl_hours': 24, 'api_cache_persist': True,
+            'requests_per_second': 5, 'incremental_refresh': True, 'summary_max_age_hours': 24,
+            'async_engine': True, 'async_concurrency': 16, 'metrics_enabled': False
+        }
+    
+    def load_settings(self):
+        """加载设置"""
+        try:
+            if os.path.exists(self.settings_file):
+                with open(self.settings_file, 'r', encoding='utf-8') as f:
+                    return {**self.defaults, **json.load(f)}
+        except: pass
+        return self.defaults.copy()
+    
+    def save_settings(self, settings):
+        """保存设置"""
+        try:
+            with atomic_open(self.settings_file, 'w', encoding='utf-8') as f:
+                json.dump(settings, f, indent=2, ensure_ascii=False)
+            return True
+        except Exception as e:
+            print(f"保存设置失败: {e}")
+            return False
+
+
+class FriendsStore:
+    """基于SQLite（WAL模式）的好友数据存储，按steamid索引，单行更新无需重写整个文件"""
+    fields = ['avatar', 'name', 'steamid', 'is_friend', 'bfd', 'removed_time', 'remark']
+    columns = {
+        'steamid': 'TEXT PRIMARY KEY', 'avatar': "TEXT NOT NULL DEFAULT ''", 'name': "TEXT NOT NULL DEFAULT ''",
+        'is_friend': "TEXT NOT NULL DEFAULT ''", 'bfd': "TEXT NOT NULL DEFAULT ''",
+        'removed_time': "TEXT NOT NULL DEFAULT ''", 'remark': "TEXT NOT NULL DEFAULT ''",
+        'friend_since': 'INTEGER NOT NULL DEFAULT 0',  # 成为好友时间的时间戳，用于排序
+        # 批量封禁扫描结果，ban_checked 为最近一次扫描的时间戳
+        'vac_banned': 'INTEGER NOT NULL DEFAULT 0', 'vac_bans': 'INTEGER NOT NULL DEFAULT 0',
+        'game_bans': 'INTEGER NOT NULL DEFAULT 0', 'days_since_last_ban': 'INTEGER NOT NULL DEFAULT 0',
+        'community_banned': 'INTEGER NOT NULL DEFAULT 0', 'economy_ban': "TEXT NOT NULL DEFAULT ''",
+        'ban_checked': 'INTEGER NOT NULL DEFAULT 0',
+        'summary_updated': 'INTEGER NOT NULL DEFAULT 0'  # 最近一次获取好友资料的时间戳，用于增量更新
+    }
+    indexes = {'bfd': 'idx_friends_bfd', 'is_friend': 'idx_friends_is_friend', 'removed_time': 'idx_friends_removed_time'}
+
+    def __init__(self, db_file='friends_data.db', csv_file='friends_data.csv'):
+        self.db_file, self.csv_file = db_file, csv_file
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._ensure_schema()
+        self._migrate_csv()
+        self._backfill_friend_since()
+
+    def _ensure_schema(self):
+        """建表、补齐新增的列并建立索引"""
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS friends (steamid TEXT PRIMARY KEY)')
+            existing = {row['name'] for row in self.conn.execute('PRAGMA table_info(friends)')}
+            for name, definition in self.columns.items():
+                if name not in existing:
+                    self.conn.execute(f'ALTER TABLE friends ADD COLUMN {name} {definition}')
+            for column, index in self.indexes.items():
+                self.conn.execute(f'CREATE INDEX IF NOT EXISTS {index} ON friends ({column})')
+            # 只追加的好友事件日志：added / removed / renamed / avatar_changed
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS friend_events (id INTEGER PRIMARY KEY AUTOINCREMENT, time INTEGER NOT NULL, '
+                "steamid TEXT NOT NULL, event TEXT NOT NULL, name TEXT NOT NULL DEFAULT '', "
+                "old TEXT NOT NULL DEFAULT '', new TEXT NOT NULL DEFAULT '')"
+            )
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_event_time ON friend_events (event, time)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_events_steamid_time ON friend_events (steamid, time)')
+
+    def _backfill_friend_since(self):
+        """为旧数据根据 bfd 补齐 friend_since"""
+        with self.lock, self.conn:
+            for steamid, bfd in self.conn.execute("SELECT steamid, bfd FROM friends WHERE friend_since = 0 AND bfd != ''").fetchall():
+                try:
+                    since = int(datetime.strptime(bfd, '%Y-%m-%d %H:%M:%S').timestamp())
+                except ValueError:
+                    continue
+                self.conn.execute('UPDATE friends SET friend_since = ? WHERE steamid = ?', (since, steamid))
+
+    def _migrate_csv(self):
+        """首次启动时从旧版 friends_data.csv 导入数据（只执行一次）"""
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone(): return
+            try:
+                with open(self.csv_file, 'r', encoding='utf-8-sig', newline='') as f:
+                    rows = [row for row in csv.DictReader(f) if row.get('steamid')]
+            except (OSError, csv.Error):
+                rows = []
+            with self.conn:
+                if rows and not self.count():
+                    self._upsert_rows(rows)
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('csv_migrated', ?)", (str(len(rows)),))
+
+    def _row(self, row):
+        return {key: ('' if row[key] is None else row[key]) for key in row.keys()}
+
+    def all(self):
+        """按插入顺序返回全部好友记录"""
+        with self.lock:
+            return [self._row(row) for row in self.conn.execute('SELECT * FROM friends ORDER BY rowid')]
+
+    def get(self, steamid):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM friends WHERE steamid = ?', (steamid,)).fetchone()
+        return self._row(row) if row else None
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM friends').fetchone()[0]
+
+    def upsert_many(self, rows):
+        """按steamid插入或更新记录，只写入行中出现且表中存在的列"""
+        started = metrics.start()
+        with self.lock, self.conn:
+            self._upsert_rows(rows)
+        metrics.observe('store_write', started, items=len(rows), op='upsert')
+
+    def _upsert_rows(self, rows):
+        for row in rows:
+            keys = [k for k in row if k in self.columns]
+            updates = ', '.join(f'{k} = excluded.{k}' for k in keys if k != 'steamid')
+            self.conn.execute(
+                f"INSERT INTO friends ({', '.join(keys)}) VALUES ({', '.join('?' * len(keys))}) "
+                f"ON CONFLICT(steamid) DO {'UPDATE SET ' + updates if updates else 'NOTHING'}",
+                [('' if row[k] is None else row[k]) for k in keys]
+            )
+
+    def update_many(self, updates):
+        """批量更新多个好友的字段，updates 为 {steamid: {字段: 值}}，在同一个事务中提交"""
+        started = metrics.start()
+        with self.lock, self.conn:
+            self._update_rows(updates)
+        metrics.observe('store_write', started, items=len(updates), op='update')
+
+    def _update_rows(self, updates):
+        for steamid, fields in updates.items():
+            keys = [k for k in fields if k in self.columns and k != 'steamid']
+            if not keys: continue
+            self.conn.execute(
+                f"UPDATE friends SET {', '.join(f'{k} = ?' for k in keys)} WHERE steamid = ?",
+                [fields[k] for k in keys] + [steamid]
+            )
+
+    def apply_changes(self, rows, events=(), touched=None):
+        """在同一个事务中写入有变化的记录并追加对应的事件
+
+        touched 为 {时间戳: [steamid]}，资料已重新获取但没有变化的好友只批量更新 summary_updated
+        """
+        started = metrics.start()
+        with self.lock, self.conn:
+            self._upsert_rows(rows)
+            self._append_events(events)
+            for when, steamids in (touched or {}).items():
+                for i in range(0, len(steamids), 500):
+                    chunk = steamids[i:i+500]
+                    self.conn.execute(
+                        f"UPDATE friends SET summary_updated = ? WHERE steamid IN ({', '.join('?' * len(chunk))})",
+                        [when] + chunk
+                    )
+        metrics.observe('store_write', started, items=len(rows), op='merge')
+
+    def update_many_with_events(self, updates, events):
+        started = metrics.start()
+        with self.lock, self.conn:
+            self._update_rows(updates)
+            self._append_events(events)
+        metrics.observe('store_write', started, items=len(updates), op='update')
+
+    def _append_events(self, events):
+        self.conn.executemany(
+            'INSERT INTO friend_events (time, steamid, event, name, old, new) VALUES (?, ?, ?, ?, ?, ?)',
+            [(e['time'], e['steamid'], e['event'], e.get('name', ''), e.get('old', ''), e.get('new', '')) for e in events]
+        )
+
+    def history(self, event=None, since=None, until=None, steamid=None, limit=None):
+        """按条件查询事件（走索引），时间为时间戳，按时间先后返回"""
+        conditions, params = [], []
+        for clause, value in (('event = ?', event), ('steamid = ?', steamid), ('time >= ?', since), ('time < ?', until)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        sql = 'SELECT time, steamid, event, name, old, new FROM friend_events'
+        if conditions: sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY time, id'
+        if limit: sql += f' LIMIT {int(limit)}'
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def compact_events(self, retention=90 * 86400, interval=7 * 86400):
+        """定期压缩事件日志：早于 retention 秒的改名和换头像事件每个好友只保留最后一条（即当时的快照），
+        添加和删除事件全部保留；距上次压缩不足 interval 秒时跳过，返回删除的事件数
+        """
+        now = int(time.time())
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'events_compacted'").fetchone()
+            if row and now - int(row['value']) < interval: return 0
+            cursor = self.conn.execute(
+                "DELETE FROM friend_events WHERE time < ? AND event IN ('renamed', 'avatar_changed') AND id NOT IN "
+                "(SELECT MAX(id) FROM friend_events WHERE time < ? AND event IN ('renamed', 'avatar_changed') GROUP BY steamid, event)",
+                (now - retention, now - retention)
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('events_compacted', ?)", (str(now),))
+            return cursor.rowcount
+
+    def delete_non_friends(self):
+        """删除所有非好友记录"""
+        started = metrics.start()
+        with self.lock, self.conn:
+            deleted = self.conn.execute("DELETE FROM friends WHERE is_friend != '✅'").rowcount
+        metrics.observe('store_write', started, items=deleted, op='delete')
+
+    def export_csv(self, path=None):
+        """导出为CSV（与旧版 friends_data.csv 格式兼容），返回导出的记录数"""
+        data = self.all()
+        fieldnames = self.fields + [k for k in self.columns if k not in self.fields]
+        with atomic_open(path or self.csv_file, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(data)
+        return len(data)
+
+
+class DebouncedWriter:
+    """写回队列：合并同一好友的多次修改，空闲 delay 秒后或手动 flush 时批量写入存储"""
+    def __init__(self, store, delay=1.0):
+        self.store, self.delay = store, delay
+        self.lock = threading.Lock()
+        self.pending, self.timer = {}, None
+        self.on_flush = None  # 写入完成后的回调，参数为 {steamid: 字段}
+        atexit.register(self.flush)
+
+    def put(self, steamid, **fields):
+        """加入队列并重新开始计时"""
+        with self.lock:
+            self.pending.setdefault(steamid, {}).update(fields)
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """立即写入所有待保存的修改"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            pending, self.pending = self.pending, {}
+        if not pending: return
+        
+        try:
+            self.store.update_many(pending)
+        except Exception as e:
+            # 写入失败时放回队列，避免丢失修改
+            with self.lock:
+                for steamid, fields in pending.items():
+                    self.pending[steamid] = {**fields, **self.pending.get(steamid, {})}
+            print(f"保存修改失败: {e}")
+            return
+        if self.on_flush:
+            self.on_flush(pending)
+
+
+class FriendsIndex:
+    """好友搜索索引：名称和备注的三元组倒排索引、有序的 steamid 数组和有序的日期数组"""
+    date_fields = ('friend_since', 'removed_time')
+
+    def __init__(self, rows):
+        self.grams = {}  # 三元组 -> steamid 集合
+        self.texts = {}  # steamid -> 已索引的文本
+        for row in rows:
+            self.update_text(row)
+        self.steamids = sorted(row['steamid'] for row in rows)
+        self.dates = None
+
+    @staticmethod
+    def _text(row):
+        # 名称与备注之间用换行分隔，避免跨字段匹配
+        return f"{row['name']}\n{row['remark'] or ''}".casefold()
+
+    def update_text(self, row):
+        """名称或备注变化后更新该行的三元组"""
+        steamid, text = row['steamid'], self._text(row)
+        old = self.texts.get(steamid)
+        if old == text: return
+        if old is not None:
+            for gram in {old[i:i+3] for i in range(len(old) - 2)}:
+                self.grams[gram].discard(steamid)
+        self.texts[steamid] = text
+        for gram in {text[i:i+3] for i in range(len(text) - 2)}:
+            self.grams.setdefault(gram, set()).add(steamid)
+
+    def match_text(self, query):
+        """名称或备注包含 query 的 steamid 集合"""
+        query = query.casefold()
+        if len(query) < 3:
+            return {sid for sid, text in self.texts.items() if query in text}
+        # 取各三元组倒排表的交集作为候选，再确认子串
+        postings = sorted((self.grams.get(query[i:i+3], set()) for i in range(len(query) - 2)), key=len)
+        return {sid for sid in postings[0].intersection(*postings[1:]) if query in self.texts[sid]}
+
+    def match_prefix(self, prefix):
+        """steamid 以 prefix 开头的集合（二分查找）"""
+        start = bisect.bisect_left(self.steamids, prefix)
+        end = bisect.bisect_left(self.steamids, prefix + '\uffff')
+        return set(self.steamids[start:end])
+
+    def match_range(self, rows, field, start=None, end=None):
+        """日期字段在 [start, end) 内的集合；日期数组在首次查询时按需排序"""
+        if self.dates is None:
+            # friend_since 为时间戳，removed_time 为可直接按字符串比较的时间文本，空值不参与
+            self.dates = {f: sorted((row[f], row['steamid']) for row in rows if row.get(f)) for f in self.date_fields}
+            self.date_keys = {f: [value for value, _ in pairs] for f, pairs in self.dates.items()}
+        keys = self.date_keys[field]
+        lo = bisect.bisect_left(keys, start) if start is not None else 0
+        hi = bisect.bisect_left(keys, end) if end is not None else len(keys)
+        return {sid for _, sid in self.dates[field][lo:hi]}
+
+
+class FriendsRepository:
+    """内存中的好友数据模型：只从存储加载一次，按steamid索引并维护选中状态，修改直接写入存储"""
+    sort_keys = {
+        'bfd': lambda row: row.get('friend_since') or 0,
+        'name': lambda row: row['name'].casefold(),
+        'is_friend': lambda row: row['is_friend'],
+        'removed_time': lambda row: row['removed_time']  # 格式为 %Y-%m-%d %H:%M:%S，可直接按字符串排序
+    }
+    sort_fields = {'bfd': 'friend_since', 'name': 'name', 'is_friend': 'is_friend', 'removed_time': 'removed_time'}
+    status_filters = {
+        'friend': lambda row: row['is_friend'] == '✅',
+        'removed': lambda row: row['is_friend'] != '✅',
+        'banned': lambda row: bool(row.get('vac_banned') or row.get('game_bans') or row.get('community_banned'))
+    }
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.RLock()
+        self.rows, self.by_id, self.selected = [], {}, set()
+        self.sorted_cache = {}  # 排序字段 -> 升序排列的行
+        self.index = None  # 搜索索引，首次筛选时建立
+        self.writer = DebouncedWriter(store)
+        self.reload()
+
+    def reload(self):
+        """从存储重新加载（仅在整体刷新等批量操作后调用）"""
+        self.writer.flush()
+        with self.lock:
+            self.rows = self.store.all()
+            self.by_id = {row['steamid']: row for row in self.rows}
+            self.selected &= set(self.by_id)
+            self.sorted_cache, self.index = {}, None
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, steamid):
+        return self.by_id.get(steamid)
+
+    def merge_preview(self, records):
+        """将刷新中途收到的一批资料合并进内存（保留备注，不写入存储），返回新增的行数"""
+        added = 0
+        with self.lock:
+            for record in records:
+                row = self.by_id.get(record['steamid'])
+                if row:
+                    row.update({k: v for k, v in record.items() if k != 'remark'})
+                else:
+                    row = self.by_id[record['steamid']] = dict(record)
+                    self.rows.append(row)
+                    added += 1
+            self.sorted_cache, self.index = {}, None
+        return added
+
+    def update_deferred(self, steamid, **fields):
+        """立即更新内存，写入存储由写回队列合并后延迟执行"""
+        with self.lock:
+            if steamid not in self.by_id: return
+            self.by_id[steamid].update(fields)
+            self._invalidate_sort(fields, steamid)
+            self.writer.put(steamid, **fields)
+
+    def _invalidate_sort(self, fields, steamid):
+        for key, field in self.sort_fields.items():
+            if field in fields:
+                self.sorted_cache.pop(key, None)
+        if self.index:
+            if 'name' in fields or 'remark' in fields:
+                self.index.update_text(self.by_id[steamid])
+            if any(f in fields for f in FriendsIndex.date_fields):
+                self.index.dates = None
+
+    def search(self, text='', status=None, date_field='friend_since', start=None, end=None, key='bfd', ascending=True):
+        """按当前排序返回符合条件的行
+        
+        text 匹配名称或备注的子串，纯数字时同时匹配 steamid 前缀；status 为 friend / removed / banned；
+        start/end 为 date_field 的取值范围 [start, end)
+        """
+        rows = self.sorted_rows(key, ascending)
+        with self.lock:
+            if self.index is None:
+                self.index = FriendsIndex(self.rows)
+            matches = None
+            if text:
+                matches = self.index.match_text(text)
+                if text.isdigit():
+                    matches |= self.index.match_prefix(text)
+            if start is not None or end is not None:
+                in_range = self.index.match_range(self.rows, date_field, start, end)
+                matches = in_range if matches is None else matches & in_range
+        if status:
+            check = self.status_filters[status]
+            rows = [row for row in rows if check(row)]
+        return rows if matches is None else [row for row in rows if row['steamid'] in matches]
+
+    def sorted_rows(self, key='bfd', ascending=True):
+        """返回按 key 排序的行；排序结果会缓存，切换方向只需反转"""
+        with self.lock:
+            if key not in self.sorted_cache:
+                self.sorted_cache[key] = sorted(self.rows, key=self.sort_keys[key])
+            rows = self.sorted_cache[key]
+        return rows if ascending else rows[::-1]
+
+    def flush(self):
+        """写入所有延迟保存的修改"""
+        self.writer.flush()
+
+    def is_selected(self, steamid):
+        return steamid in self.selected
+
+    def set_selected(self, steamid, is_selected):
+        with self.lock:
+            if is_selected and steamid in self.by_id:
+                self.selected.add(steamid)
+            else:
+                self.selected.discard(steamid)
+
+    def select_all(self, is_selected, steamids=None):
+        """全选或全不选；指定 steamids 时只改变这些好友的选中状态（例如筛选结果）"""
+        with self.lock:
+            if steamids is None:
+                self.selected = set(self.by_id) if is_selected else set()
+            elif is_selected:
+                self.selected |= set(steamids) & set(self.by_id)
+            else:
+                self.selected -= set(steamids)
+
+    def clear_selection(self):
+        self.select_all(False)
+
+    @property
+    def all_selected(self):
+        return bool(self.rows) and len(self.selected) == len(self.rows)
+
+    def selected_ids(self):
+        return list(self.selected)
+
+
+class AvatarCache:
+    """按内容哈希存储的头像缓存：相同图片只存一份，超出容量时按最近最少使用淘汰
+    
+    owner 为缓存键：好友表格的头像使用 steamid，资料卡的大头像使用 "steamid:profile"，两者互不替换
+    """
+    def __init__(self, avatar_dir, max_bytes=200 * 1024 * 1024):
+        self.avatar_dir = avatar_dir
+        self.max_bytes = max_bytes
+        self.index_file = os.path.abspath(os.path.join(avatar_dir, 'index.json'))  # 退出时保存不受当前目录变化影响
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.dirty, self.last_save = False, 0
+        os.makedirs(self.avatar_dir, exist_ok=True)
+        
+        # owners: owner -> {hash, url, etag, last_modified}；files: hash -> {ext, size, last_used}，按最近使用排序
+        self.owners, self.files = {}, {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.owners, files = index.get('owners', {}), index.get('files', {})
+            self.files = {d: files[d] for d in sorted(files, key=lambda d: files[d]['last_used'])}
+        except: pass
+        # refs: hash -> 引用它的 owner 集合；total_bytes: 缓存文件总大小
+        self.refs = {}
+        for owner, info in self.owners.items():
+            self.refs.setdefault(info['hash'], set()).add(owner)
+        self.total_bytes = sum(info['size'] for info in self.files.values())
+        atexit.register(self.save)
+
+    def path(self, digest):
+        return os.path.join(self.avatar_dir, digest + self.files[digest]['ext'])
+
+    def _use(self, digest):
+        """刷新使用时间并移到最近使用的一端"""
+        info = self.files.pop(digest)
+        info['last_used'] = time.time()
+        self.files[digest] = info
+
+    def lookup(self, url, owner):
+        """命中时返回本地路径并刷新使用时间，未命中返回None"""
+        with self.lock:
+            info = self.owners.get(owner)
+            if info and info['url'] == url and info['hash'] in self.files and os.path.exists(self.path(info['hash'])):
+                self._use(info['hash'])
+                self.hits, self.dirty = self.hits + 1, True
+                return self.path(info['hash'])
+            return None
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def validators(self, owner):
+        """返回已缓存头像的URL及ETag/Last-Modified，文件不存在时返回None"""
+        with self.lock:
+            info = self.owners.get(owner)
+            if info and info['hash'] in self.files and os.path.exists(self.path(info['hash'])):
+                return dict(info)
+            return None
+
+    def touch(self, owner):
+        """304未修改时刷新使用时间并返回本地路径"""
+        with self.lock:
+            info = self.owners.get(owner)
+            if not info or info['hash'] not in self.files: return None
+            self._use(info['hash'])
+            self.hits, self.dirty = self.hits + 1, True
+            return self.path(info['hash'])
+
+    def store(self, url, owner, content, etag=None, last_modified=None):
+        """保存头像内容及其校验信息，返回本地路径"""
+        digest = hashlib.sha1(content).hexdigest()
+        ext = os.path.splitext(os.path.basename(url))[1] or '.jpg'
+        with self.lock:
+            exists = digest in self.files and os.path.exists(self.path(digest))
+            ext = self.files[digest]['ext'] if digest in self.files else ext
+        if not exists:
+            # 头像可以重新下载，在锁外写入且不 fsync，避免所有下载线程排队等待磁盘
+            self._write(os.path.join(self.avatar_dir, digest + ext), content)
+        
+        with self.lock:
+            if digest not in self.files or not os.path.exists(self.path(digest)):
+                # 写入期间被其他线程淘汰时重新写入
+                self.total_bytes += len(content) - self.files.get(digest, {}).get('size', 0)
+                self.files[digest] = {'ext': ext, 'size': len(content), 'last_used': time.time()}
+                if not os.path.exists(self.path(digest)):
+                    self._write(self.path(digest), content)
+            self._use(digest)
+            
+            old = self.owners.get(owner)
+            self.owners[owner] = {'hash': digest, 'url': url, 'etag': etag, 'last_modified': last_modified}
+            self.refs.setdefault(digest, set()).add(owner)
+            # 头像更换后旧图片若无人引用则立即删除
+            if old and old['hash'] != digest:
+                refs = self.refs.get(old['hash'], set())
+                refs.discard(owner)
+                if not refs:
+                    self._remove(old['hash'])
+            
+            self._evict(keep=digest)
+            self.dirty = True
+            path = self.path(digest)
+        
+        if time.time() - self.last_save > 2:
+            self.save()
+        return path
+
+    @staticmethod
+    def _write(path, content):
+        with atomic_open(path, 'wb', durable=False) as f:
+            f.write(content)
+
+    def _remove(self, digest):
+        """删除图片文件及引用它的索引项"""
+        info = self.files.pop(digest, None)
+        for owner in self.refs.pop(digest, ()):
+            del self.owners[owner]
+        if info:
+            self.total_bytes -= info['size']
+            try: os.remove(os.path.join(self.avatar_dir, digest + info['ext']))
+            except OSError: pass
+
+    def _evict(self, keep=None):
+        """超出容量时从最久未使用的一端删除图片"""
+        while self.total_bytes > self.max_bytes:
+            digest = next((d for d in self.files if d != keep), None)
+            if digest is None: break
+            self._remove(digest)
+            self.evictions += 1
+
+    def save(self):
+        """保存索引"""
+        with self.lock:
+            if not self.dirty: return
+            index = {'owners': dict(self.owners), 'files': dict(self.files)}
+            self.dirty, self.last_save = False, time.time()
+        try:
+            with atomic_open(self.index_file, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+        except Exception as e:
+            print(f"保存头像索引失败: {e}")
+
+    def stats(self):
+        return {
+            'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+            'files': len(self.files), 'bytes': self.total_bytes
+        }
+
+
+class AvatarFetcher:
+    """头像下载器：独立的线程池和连接池，与资料请求并行下载头像"""
+    def __init__(self, cache, max_workers=8):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.sess = requests.Session()
+        self.sess.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.sess.mount('https://', adapter)
+        self.sess.mount('http://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='avatar')
+
+    def set_proxy(self, proxy):
+        if proxy:
+            self.sess.proxies.update({'http': proxy, 'https': proxy})
+
+    def cached_path(self, url, steamid):
+        """已缓存则返回本地路径，否则返回None"""
+        return self.cache.lookup(url, steamid)
+
+    def download(self, url, steamid, revalidate=False):
+        """同步下载头像，失败时返回原URL；revalidate 时带条件请求头向服务器确认是否变化"""
+        headers = {}
+        if revalidate:
+            cached = self.cache.validators(steamid)
+            if cached and cached['url'] == url:
+                if cached.get('etag'): headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'): headers['If-Modified-Since'] = cached['last_modified']
+        else:
+            path = self.cache.lookup(url, steamid)
+            if path: return path
+        
+        started = metrics.start()
+        try:
+            response = self.sess.get(url, headers=headers, timeout=10)
+            metrics.observe('avatar_download', started, response.status_code, len(response.content),
+                            mode='revalidate' if headers else 'download')
+            if response.status_code == 304 and headers:
+                return self.cache.touch(steamid) or url
+            if response.status_code != 200: return url
+            self.cache.record_miss()
+            return self.cache.store(url, steamid, response.content,
+                                    response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        except:
+            metrics.observe('avatar_download', started, 'error', mode='revalidate' if headers else 'download')
+            return url
+
+    def submit(self, url, steamid, revalidate=False):
+        """提交后台下载任务，返回 Future，结果为 (steamid, 本地路径或URL)"""
+        return self.pool.submit(lambda: (steamid, self.download(url, steamid, revalidate)))
+
+    def when_done(self, futures, callback):
+        """所有下载完成后在后台线程中调用 callback({steamid: path})"""
+        def waiter():
+            wait(futures)
+            results = {}
+            for future in futures:
+                try:
+                    steamid, path = future.result()
+                    results[steamid] = path
+                except Exception as e:
+                    print(f"下载头像失败: {e}")
+            self.cache.save()
+            callback(results)
+        
+        threading.Thread(target=waiter, daemon=True).start()
+
+
+class TokenBucket:
+    """令牌桶限速器：平均每秒 rate 个请求，允许 burst 个突发请求"""
+    def __init__(self, rate=5, burst=10):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = burst, time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """尝试取得一个令牌，成功返回0，否则返回需要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return max(self.paused_until - now, (1 - self.tokens) / self.rate)
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        wait_time = self.try_acquire()
+        while wait_time:
+            time.sleep(wait_time)
+            wait_time = self.try_acquire()
+
+    async def acquire_async(self):
+        """异步等待直到取得一个令牌"""
+        wait_time = self.try_acquire()
+        while wait_time:
+            await asyncio.sleep(wait_time)
+            wait_time = self.try_acquire()
+
+    def pause(self, seconds):
+        """服务器要求等待时（Retry-After），所有请求一起暂停"""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class RateLimitedSession(requests.Session):
+    """所有请求共享同一个令牌桶；遇到429/503时遵循 Retry-After，否则指数退避加随机抖动后重试"""
+    retry_statuses = (429, 503)
+
+    def __init__(self, rate=5, burst=10, max_retries=5, backoff=1.0, max_backoff=60):
+        super().__init__()
+        self.limiter = TokenBucket(rate, burst)
+        self.max_retries, self.backoff, self.max_backoff = max_retries, backoff, max_backoff
+
+    def request(self, method, url, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            started = metrics.start()
+            response = super().request(method, url, *args, **kwargs)
+            metrics.observe('http_request', started, response.status_code, len(response.content),
+                            url=url, method=method.upper())
+            if response.status_code not in self.retry_statuses or attempt == self.max_retries:
+                return response
+            
+            self.limiter.pause(self.retry_delay(response, attempt))
+        return response
+
+    def retry_delay(self, response, attempt):
+        """优先使用 Retry-After，否则指数退避并加入随机抖动"""
+        delay = self._retry_after(response)
+        if delay is None:
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+        return delay
+
+    def _retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value: return None
+        try:
+            return min(self.max_backoff, float(value))
+        except ValueError:
+            # HTTP日期格式
+            try:
+                from email.utils import parsedate_to_datetime
+                return min(self.max_backoff, max(0, parsedate_to_datetime(value).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                return None
+
+
+class CachedResponse:
+    """缓存命中时返回的响应对象，提供与 requests.Response 相同的 status_code/text/json()"""
+    def __init__(self, status_code, text):
+        self.status_code, self.text = status_code, text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    """Steam Web API 响应缓存：按接口+参数（不含API密钥）缓存，各接口独立过期时间，可选落盘"""
+    ttls = {  # 未列出的接口（如添加/删除好友）不缓存
+        'GetPlayerSummaries': 300, 'GetOwnedGames': 3600,
+        'GetPlayerBans': 3600, 'GetRecentlyPlayedGames': 600
+    }
+
+    def __init__(self, db_file=None):
+        self.lock = threading.Lock()
+        self.memory = {}  # key -> (过期时间, 状态码, 响应文本)
+        self.hits = self.misses = 0
+        self.conn = None
+        if db_file:
+            self.conn = sqlite3.connect(db_file, check_same_thread=False)
+            with self.conn:
+                self.conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL, status INTEGER, body TEXT)')
+                self.conn.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+
+    def ttl(self, url):
+        parts = urlparse(url).path.split('/')
+        return next((self.ttls[p] for p in parts if p in self.ttls), 0)
+
+    def key(self, url, params):
+        params = sorted((k, str(v)) for k, v in (params or {}).items() if k != 'key')
+        return f"{urlparse(url).path}?{urlencode(params)}"
+
+    def get(self, url, params):
+        """命中未过期的缓存时返回 CachedResponse，否则返回None"""
+        if not self.ttl(url): return None
+        key, now = self.key(url, params), time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if not entry and self.conn:
+                row = self.conn.execute('SELECT expires, status, body FROM responses WHERE key = ?', (key,)).fetchone()
+                if row:
+                    entry = self.memory[key] = tuple(row)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return CachedResponse(entry[1], entry[2])
+            self.misses += 1
+            return None
+
+    def put(self, url, params, response):
+        """缓存成功的响应"""
+        ttl = self.ttl(url)
+        if not ttl or response.status_code != 200: return
+        entry = (time.time() + ttl, response.status_code, response.text)
+        key = self.key(url, params)
+        with self.lock:
+            self.memory[key] = entry
+            if self.conn:
+                with self.conn:
+                    self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)', (key, *entry))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.memory)}
+
+
+class AsyncSteamClient:
+    """基于 httpx 的异步请求层，运行在 Flet 的事件循环上
+    
+    共用一个连接池（可用时启用HTTP/2）和一个并发上限，并与同步会话共享令牌桶限速；
+    好友列表、资料、头像、用户信息的请求可以相互重叠而无需为每个操作创建线程
+    """
+    def __init__(self, steam, max_concurrency=16):
+        self.steam = steam
+        self.max_concurrency = max_concurrency
+        self.client = self.semaphore = self.loop = self.config = None
+        self.proxy = None
+        self.tasks = set()  # 后台任务，保存引用以免被回收
+
+    def _spawn(self, coro, label):
+        """在当前事件循环中启动后台任务，失败时输出错误"""
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(lambda t: self._task_done(t, label))
+        return task
+
+    def _task_done(self, task, label):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"{label}失败: {task.exception()!r}")
+
+    def set_proxy(self, proxy):
+        self.proxy = proxy or None
+
+    def _ensure_client(self):
+        """按当前事件循环、代理和并发上限返回 (连接池, 并发限制)，设置变化时替换并关闭旧连接池"""
+        loop = asyncio.get_running_loop()
+        config = (self.proxy, self.max_concurrency)
+        if self.client is None or loop is not self.loop or config != self.config:
+            old = (self.client, self.semaphore, self.config[1]) if self.client else None
+            old_loop = self.loop
+            kwargs = {'proxy': self.proxy} if self.proxy else {}
+            self.client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE, timeout=10, headers=dict(self.steam.sess.headers),
+                limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+                **kwargs
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.loop, self.config = loop, config
+            if old and old_loop is loop:
+                self._spawn(self._close_when_idle(*old), "关闭旧连接池")
+            elif old and old_loop.is_running():
+                asyncio.run_coroutine_threadsafe(self._close_when_idle(*old), old_loop)
+            # 旧事件循环已停止时连接已无法使用，直接丢弃
+        return self.client, self.semaphore
+
+    async def _close_when_idle(self, client, semaphore, permits):
+        """等待旧连接池上进行中的请求完成后关闭"""
+        for _ in range(permits):
+            await semaphore.acquire()
+        await client.aclose()
+
+    async def get(self, url, params=None, headers=None, timeout=None, limited=True):
+        """发送GET请求；Steam Web API 请求受令牌桶限速，429/503时按 Retry-After 或指数退避重试"""
+        sess = self.steam.sess
+        for attempt in range(sess.max_retries + 1):
+            if limited:
+                await sess.limiter.acquire_async()
+            started = metrics.start() if limited else None  # 头像请求由 download_avatar 单独记录
+            client, semaphore = self._ensure_client()  # 每次尝试取当前连接池，重试不会落在已替换的连接池上
+            async with semaphore:
+                response = await client.get(url, params=params, headers=headers, timeout=timeout or 10)
+            metrics.observe('http_request', started, response.status_code, len(response.content),
+                            url=url, method='GET')
+            if not limited or response.status_code not in sess.retry_statuses or attempt == sess.max_retries:
+                return response
+            sess.limiter.pause(sess.retry_delay(response, attempt))
+        return response
+
+    async def request_cached(self, url, params, timeout=None):
+        """与 _make_request 相同，可缓存的接口优先使用响应缓存（缓存读写在线程中进行）"""
+        started = metrics.start()
+        cached = await asyncio.to_thread(self.steam.response_cache.get, url, params)
+        if cached:
+            metrics.observe('api_call', started, cached.status_code, url=url, cache='hit')
+            return cached
+        response = await self.get(url, params, timeout=timeout)
+        await asyncio.to_thread(self.steam.response_cache.put, url, params, response)
+        metrics.observe('api_call', started, response.status_code, url=url, cache='miss')
+        return response
+
+    async def get_friend_list(self):
+        steam = self.steam
+        response = await self.get(steam.urls['friends'], {'key': steam.steam_web_api, 'steamid': steam.steam_id})
+        return steam._handle_friend_list(response)
+
+    async def fetch_summaries_batch(self, batch):
+        steam = self.steam
+        response = await self.get(steam.urls['summaries'], {'key': steam.steam_web_api, 'steamids': ','.join(batch)})
+        return steam._parse_summaries_batch(response, batch)
+
+    async def download_avatar(self, url, steamid, revalidate=False):
+        """异步下载头像，逻辑与 AvatarFetcher.download 相同，返回 (steamid, 本地路径或URL)"""
+        cache = self.steam.avatar_cache
+        headers = {}
+        if revalidate:
+            cached = cache.validators(steamid)
+            if cached and cached['url'] == url:
+                if cached.get('etag'): headers['If-None-Match'] = cached['etag']
+                if cached.get('last_modified'): headers['If-Modified-Since'] = cached['last_modified']
+        else:
+            path = cache.lookup(url, steamid)
+            if path: return steamid, path
+        
+        started = metrics.start()
+        try:
+            response = await self.get(url, headers=headers, limited=False)
+            metrics.observe('avatar_download', started, response.status_code, len(response.content),
+                            mode='revalidate' if headers else 'download')
+            if response.status_code == 304 and headers:
+                return steamid, cache.touch(steamid) or url
+            if response.status_code != 200: return steamid, url
+            cache.record_miss()
+            return steamid, await asyncio.to_thread(cache.store, url, steamid, response.content,
+                                                    response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        except Exception:
+            metrics.observe('avatar_download', started, 'error', mode='revalidate' if headers else 'download')
+            return steamid, url
+
+    async def download_profile_avatar(self, url, steamid):
+        """异步版本的 SteamFriendsFixedGUI.download_avatar：资料卡头像单独登记缓存，返回本地路径或URL"""
+        return (await self.download_avatar(url, f"{steamid}:profile"))[1]
+
+    async def update_friends_list(self, incremental=False, max_age=24 * 3600, on_batch=None):
+        """异步版本的 update_friends_list：各批资料并发请求，头像下载作为后台任务在同一事件循环中进行
+        
+        读写数据库、检查点和头像文件等阻塞操作放到线程中执行，不阻塞界面所在的事件循环
+        """
+        with self.steam.refresh_lock():
+            return await self._update_friends_list(incremental, max_age, on_batch)
+
+    async def _update_friends_list(self, incremental, max_age, on_batch):
+        steam = self.steam
+        steam.friend_data, steam.avatar_futures = [], []
+        await self.get_friend_list()
+        
+        data_dict, fetch_ids = await asyncio.to_thread(steam._plan_refresh, incremental, max_age)
+        batches = [fetch_ids[i:i+100] for i in range(0, len(fetch_ids), 100)]
+        done = await asyncio.to_thread(steam._load_checkpoint, fetch_ids) if batches else {}
+        avatar_jobs = []
+        
+        def record(user):
+            path = steam.avatars.cached_path(user['avatar'], user['steamid'])
+            if not path:
+                avatar_jobs.append((user['avatar'], user['steamid']))
+            return steam._player_record(user, path or user['avatar'])
+        
+        for records in done.values():
+            for item in records:
+                if not os.path.exists(item['avatar']):
+                    avatar_jobs.append((item['avatar'], item['steamid']))
+        if on_batch:
+            for count, index in enumerate(sorted(done), 1):
+                on_batch(count, len(batches), done[index])
+        
+        def save(index, players):
+            records = [record(user) for user in players]
+            steam._append_checkpoint(index, records)
+            return records
+        
+        async def fetch(index):
+            players = await self.fetch_summaries_batch(batches[index])
+            done[index] = await asyncio.to_thread(save, index, players)
+            if on_batch: on_batch(len(done), len(batches), done[index])
+        
+        results = await asyncio.gather(*(fetch(i) for i in range(len(batches)) if i not in done), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            raise Exception(f"{len(errors)}/{len(batches)} 批好友资料获取失败，已完成的批次会在下次更新时继续使用：{errors[0]}")
+        for i in range(len(batches)):
+            steam.friend_data.extend(done[i])
+        
+        updated = await asyncio.to_thread(steam._merge_refresh, data_dict, fetch_ids)
+        if avatar_jobs:
+            self._spawn(self._download_avatars(avatar_jobs), "后台下载头像")
+        return updated
+
+    async def _download_avatars(self, jobs):
+        results = await asyncio.gather(*(self.download_avatar(url, steamid) for url, steamid in jobs))
+        await asyncio.to_thread(self.steam.avatar_cache.save)
+        await asyncio.to_thread(self.steam._apply_downloaded_avatars, dict(results))
+
+    async def refresh_avatars(self):
+        """异步版本的 refresh_avatars"""
+        steam = self.steam
+        
+        def plan():
+            jobs = []
+            for item in steam.read_friends_data():
+                if item['steamid']:
+                    cached = steam.avatar_cache.validators(item['steamid'])
+                    url = cached['url'] if cached else f"{steam.avatar_base_url}/{item['steamid']}_full.jpg"
+                    jobs.append((url, item['steamid']))
+            return jobs
+        
+        jobs = await asyncio.to_thread(plan)
+        results = await asyncio.gather(*(self.download_avatar(url, steamid, revalidate=True) for url, steamid in jobs))
+        await asyncio.to_thread(steam.avatar_cache.save)
+        return await asyncio.to_thread(steam._save_avatar_paths, dict(results))
+
+    async def get_user_info(self, friend_code):
+        """异步版本的 get_user_info：资料与三项附加查询同时发出，附加查询各自超时"""
+        steam = self.steam
+        steamid64 = steam._friend_code_to_steamid(friend_code)
+        if not steamid64:
+            raise Exception("无效的好友代码")
+        
+        extras = {
+            'game_count': (steam._parse_game_count, 0, '游戏数量'),
+            'ban_info': (steam._parse_user_bans, None, '封禁信息'),
+            'recent_game': (steam._parse_recent_game, None, '最近游戏信息')
+        }
+        
+        async def lookup(kind):
+            parse, default, label = extras[kind]
+            try:
+                url, params = steam._profile_request(kind, steamid64)
+                response = await asyncio.wait_for(self.request_cached(url, params), steam.profile_timeout)
+                return parse(response)
+            except Exception as e:
+                print(f"获取{label}超时或失败: {e!r}")
+                return default
+        
+        tasks = {kind: asyncio.ensure_future(lookup(kind)) for kind in extras}
+        try:
+            url, params = steam._profile_request('summary', steamid64)
+            user_info = steam._parse_user_summary(
+                await asyncio.wait_for(self.request_cached(url, params), steam.profile_timeout)
+            )
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        for kind, task in tasks.items():
+            user_info[kind] = await task
+        return user_info
+
+
+class SteamFriendsFixedGUI:
+    def __init__(self, avatar_workers=8, avatar_cache_bytes=200 * 1024 * 1024, api_cache_file=None,
+                 base_url='https://api.steampowered.com', avatar_base_url='https://avatars.akamai.steamstatic.com'):
+        self.steam_web_api = self.steam_id = None
+        self.friends = 0
+        self.friends_list = {}
+        self.friend_data = []
+        self.avatar_futures = []
+        self.on_avatars_ready = None  # 头像全部下载完成后的回调，参数为更新的头像数
+        self.profile_timeout = 8  # 用户信息附加查询（游戏数、封禁、最近游戏）的单项超时秒数
+        self.lookup_pool = ThreadPoolExecutor(max_workers=6, thread_name_prefix='lookup')
+        self.checkpoint_file = 'refresh_checkpoint.jsonl'
+        self.lock_file = 'steam_friends.lock'  # 与 headless.py 共用的刷新锁
+        self.last_refresh_stats = {'fetched': 0, 'skipped': 0}
+        
+        self.base_url, self.avatar_base_url = base_url, avatar_base_url  # 可指向本地模拟服务器（见 benchmark.py）
+        self.urls = {
+            'friends': f'{base_url}/ISteamUser/GetFriendList/v0001/',
+            'summaries': f'{base_url}/ISteamUser/GetPlayerSummaries/v0002/',
+            'remove_friend': f'{base_url}/ISteamUser/RemoveFriend/v1/'
+        }
+        
+        self.sess = RateLimitedSession()
+        self.sess.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        self.set_max_workers(4)
+        
+        self.avatar_dir = 'avatar_cache'
+        self.avatar_cache = AvatarCache(self.avatar_dir, avatar_cache_bytes)
+        self.avatars = AvatarFetcher(self.avatar_cache, avatar_workers)
+        self.store = FriendsStore()
+        self.response_cache = ResponseCache(api_cache_file)
+        self.async_client = AsyncSteamClient(self) if httpx else None
+
+    def set_proxy(self, proxy):
+        if proxy:
+            self.sess.proxies.update({'http': proxy, 'https': proxy})
+        self.avatars.set_proxy(proxy)
+        if self.async_client:
+            self.async_client.set_proxy(proxy)
+
+    def set_max_workers(self, max_workers):
+        """设置并发请求数，同时放大连接池以免并发时丢弃连接"""
+        max_workers = max(1, int(max_workers or 1))
+        if getattr(self, 'max_workers', None) == max_workers: return
+        self.max_workers = max_workers
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.sess.mount('https://', adapter)
+        self.sess.mount('http://', adapter)
+
+    def set_rate_limit(self, requests_per_second):
+        """设置所有 Steam Web API 请求共享的速率上限"""
+        rate = max(0.1, float(requests_per_second or 1))
+        self.sess.limiter.rate, self.sess.limiter.burst = rate, max(1, rate * 2)
+
+    def get_friend_list(self):
+        response = self.sess.get(self.urls['friends'], params={'key': self.steam_web_api, 'steamid': self.steam_id})
+        return self._handle_friend_list(response)
+
+    def _handle_friend_list(self, response):
+        """解析 GetFriendList 响应（同步与异步请求共用）"""
+        if response.status_code == 200:
+            friends = response.json()['friendslist']['friends']
+            self.friends_list = {f['steamid']: f['friend_since'] for f in friends}
+            self.friends = len(self.friends_list)
+            return True
+            
+        status_map = {
+            401: "Unauthorized，请检查你的steam隐私设置",
+            403: "403 Forbidden，请检查你的web_api和id的值",
+            500: "服务器内部错误，请检查你的steamid的值"
+        }
+        raise Exception(status_map.get(response.status_code, f"收到未处理的状态码：{response.status_code}"))
+
+    def _fetch_summaries_batch(self, batch):
+        """获取一批（最多100个）好友的资料，按传入的ID顺序返回"""
+        response = self.sess.get(self.urls['summaries'], params={'key': self.steam_web_api, 'steamids': ','.join(batch)})
+        return self._parse_summaries_batch(response, batch)
+
+    def _parse_summaries_batch(self, response, batch):
+        if response.status_code != 200:
+            raise Exception("429 Too Many Requests" if response.status_code == 429 else response.text)
+        
+        players = {p['steamid']: p for p in response.json()['response']['players']}
+        return [players[sid] for sid in batch if sid in players]
+
+    def _player_record(self, user, avatar=None):
+        """将 GetPlayerSummaries 返回的玩家转换为好友记录，avatar 为空时提交后台线程池下载头像"""
+        return {
+            'avatar': avatar or self._queue_avatar(user['avatar'], user['steamid']),
+            'name': re.sub(r'[|\-+:"\'\n\r]', '`', user['personaname']),
+            'steamid': user['steamid'],
+            'is_friend': '✅',
+            'bfd': datetime.fromtimestamp(self.friends_list[user['steamid']]).strftime('%Y-%m-%d %H:%M:%S'),
+            'removed_time': '',
+            'remark': '',
+            'friend_since': self.friends_list[user['steamid']],
+            'summary_updated': int(time.time())
+        }
+
+    def _load_checkpoint(self, steam_ids):
+        """读取与本次好友列表一致的检查点，返回 {批次序号: 记录列表}；不一致时重新开始"""
+        ids_hash = hashlib.sha1(','.join(steam_ids).encode()).hexdigest()
+        done = {}
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            if lines and json.loads(lines[0]).get('ids_hash') == ids_hash:
+                for line in lines[1:]:
+                    try:
+                        batch = json.loads(line)
+                    except ValueError:
+                        break  # 中断时写了一半的行
+                    done[batch['index']] = batch['records']
+                return done
+        except (OSError, ValueError): pass
+        
+        with atomic_open(self.checkpoint_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'ids_hash': ids_hash}) + '\n')
+        return done
+
+    def _append_checkpoint(self, index, records):
+        """追加一个已完成的批次"""
+        with open(self.checkpoint_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'index': index, 'records': records}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear_checkpoint(self):
+        try: os.remove(self.checkpoint_file)
+        except OSError: pass
+
+    def get_friends_summaries(self, steam_ids=None, on_batch=None):
+        """获取好友资料，steam_ids 为空时获取全部好友；每完成一批调用 on_batch(已完成批次, 总批次, 本批记录)"""
+        for progress in self.iter_friends_summaries(steam_ids):
+            if on_batch: on_batch(*progress)
+
+    def iter_friends_summaries(self, steam_ids=None):
+        """逐批产出 (已完成批次, 总批次, 本批记录)，全部批次结束后按批次顺序填充 friend_data"""
+        steam_ids = list(self.friends_list.keys()) if steam_ids is None else list(steam_ids)
+        batches = [steam_ids[i:i+100] for i in range(0, len(steam_ids), 100)]
+        if not batches: return
+        
+        # 从检查点恢复已完成的批次；头像尚未下载完成的记录重新加入下载队列
+        done = self._load_checkpoint(steam_ids)
+        for records in done.values():
+            for record in records:
+                if not os.path.exists(record['avatar']):
+                    record['avatar'] = self._queue_avatar(record['avatar'], record['steamid'])
+        pending = [i for i in range(len(batches)) if i not in done]
+        for count, index in enumerate(sorted(done), 1):
+            yield count, len(batches), done[index]
+        
+        # 各批次并发请求，每完成一批立即写入检查点并产出；失败的批次不影响其他批次，全部结束后再抛出
+        errors = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(pending))) as pool:
+                futures = {pool.submit(self._fetch_summaries_batch, batches[i]): i for i in pending}
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        done[index] = [self._player_record(user) for user in future.result()]
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    self._append_checkpoint(index, done[index])
+                    yield len(done), len(batches), done[index]
+        if errors:
+            raise Exception(f"{len(errors)}/{len(batches)} 批好友资料获取失败，已完成的批次会在下次更新时继续使用：{errors[0]}")
+        
+        # 按批次顺序合并，保证 friend_data 顺序稳定
+        for i in range(len(batches)):
+            self.friend_data.extend(done[i])
+
+    def _queue_avatar(self, url, steamid):
+        """已缓存的头像直接返回本地路径，否则提交后台下载并暂时使用远程URL"""
+        path = self.avatars.cached_path(url, steamid)
+        if path: return path
+        self.avatar_futures.append(self.avatars.submit(url, steamid))
+        return url
+
+    def _apply_downloaded_avatars(self, results):
+        """将后台下载完成的头像路径写回好友数据"""
+        count = self._save_avatar_paths(results)
+        if self.on_avatars_ready:
+            self.on_avatars_ready(count)
+
+    def _save_avatar_paths(self, results):
+        """只更新头像路径有变化的行，返回更新数量；本地头像被替换为另一张本地头像时记录换头像事件"""
+        changed, events, now = {}, [], int(time.time())
+        for item in self.read_friends_data():
+            path = results.get(item['steamid'])
+            if path and path != item['avatar']:
+                changed[item['steamid']] = {'avatar': path}
+                if not path.startswith('http') and item['avatar'] and not item['avatar'].startswith('http'):
+                    events.append({'time': now, 'steamid': item['steamid'], 'event': 'avatar_changed',
+                                   'name': item['name'], 'old': item['avatar'], 'new': path})
+        self.store.update_many_with_events(changed, events)
+        return len(changed)
+
+    def refresh_avatars(self):
+        """并发重新验证所有头像，未变化的头像只产生一次304响应，返回更新的头像数"""
+        data = self.read_friends_data()
+        if not data: return 0
+        
+        futures = []
+        for item in data:
+            if item['steamid']:
+                # 优先使用缓存记录的原始URL，以便携带对应的校验信息
+                cached = self.avatar_cache.validators(item['steamid'])
+                url = cached['url'] if cached else f"{self.avatar_base_url}/{item['steamid']}_full.jpg"
+                futures.append(self.avatars.submit(url, item['steamid'], revalidate=True))
+        wait(futures)
+        self.avatar_cache.save()
+        return self._save_avatar_paths(dict(future.result() for future in futures))
+
+    def read_friends_data(self):
+        """读取好友数据"""
+        started = metrics.start()
+        data = self.store.all()
+        metrics.observe('store_read', started, items=len(data))
+        return data
+
+    def export_friends_csv(self, path='friends_data.csv'):
+        """导出好友数据为CSV"""
+        return self.store.export_csv(path)
+    
+    def download_avatar(self, url, steamid):
+        """下载资料卡头像；单独登记缓存，不会替换或删除好友表格正在使用的头像"""
+        return self.avatars.download(url, f"{steamid}:profile")
+
+    def update_friends_list(self, incremental=False, max_age=24 * 3600, on_batch=None):
+        """更新好友列表，头像在后台继续下载，完成后写回并回调 on_avatars_ready
+        
+        资料按批次写入检查点，失败后再次调用会从上次完成的批次继续。
+        incremental 为 True 时只获取新增、重新添加以及资料超过 max_age 秒未更新的好友的资料，
+        删除的好友直接标记，不产生额外请求。每收到一批资料即调用 on_batch(已完成批次, 总批次, 本批记录)
+        """
+        with self.refresh_lock():
+            return self._update_friends_list(incremental, max_age, on_batch)
+
+    def _update_friends_list(self, incremental, max_age, on_batch):
+        self.friend_data, self.avatar_futures = [], []
+        self.get_friend_list()
+        
+        data_dict, fetch_ids = self._plan_refresh(incremental, max_age)
+        self.get_friends_summaries(fetch_ids, on_batch)
+        updated = self._merge_refresh(data_dict, fetch_ids)
+        
+        if self.avatar_futures:
+            self.avatars.when_done(self.avatar_futures, self._apply_downloaded_avatars)
+        return updated
+
+    @contextmanager
+    def refresh_lock(self):
+        """刷新期间持有数据目录的锁文件，图形界面与无界面模式不会同时写入好友数据和检查点"""
+        lock = LockFile(self.lock_file)
+        if not lock.acquire():
+            raise Exception("另一个实例（图形界面或无界面模式）正在更新好友列表，请稍后再试")
+        try:
+            yield
+        finally:
+            lock.release()
+
+    def _plan_refresh(self, incremental, max_age):
+        """根据已获取的好友列表确定需要请求资料的好友，返回 (已存储的记录, 需要请求的steamid)"""
+        data_dict = {d['steamid']: d for d in self.read_friends_data()}
+        if incremental:
+            cutoff = time.time() - max_age
+            fetch_ids = [sid for sid in self.friends_list
+                         if sid not in data_dict or data_dict[sid]['is_friend'] != '✅'
+                         or (data_dict[sid].get('summary_updated') or 0) < cutoff]
+        else:
+            fetch_ids = list(self.friends_list)
+        self.last_refresh_stats = {'fetched': len(fetch_ids), 'skipped': len(self.friends_list) - len(fetch_ids)}
+        return data_dict, fetch_ids
+
+    def _merge_refresh(self, data_dict, fetch_ids):
+        """将 friend_data 合并进已存储的记录，只写入有变化的行并记录事件，返回合并后的全部记录"""
+        current = {f['steamid']: f for f in self.friend_data}
+        fetched = set(fetch_ids)
+        before = {sid: dict(d) for sid, d in data_dict.items()}
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        updated = []
+        
+        # 处理当前好友（保留已有的备注；新头像尚未下载完成时暂时保留旧的本地头像）
+        for steamid, friend_info in current.items():
+            if steamid in data_dict:
+                old = data_dict[steamid]
+                keep_avatar = friend_info['avatar'].startswith('http') and os.path.exists(old['avatar'])
+                old.update({k: v for k, v in friend_info.items() if k != 'remark' and not (k == 'avatar' and keep_avatar)})
+                updated.append(data_dict.pop(steamid))
+            else:
+                updated.append(friend_info)
+        
+        # 资料仍在有效期内、本次未请求的好友保持不变
+        for steamid in self.friends_list:
+            if steamid not in fetched and steamid in data_dict:
+                updated.append(data_dict.pop(steamid))
+        
+        # 处理已删除的好友
+        for d in data_dict.values():
+            if d['is_friend'] == '✅':
+                d.update({'is_friend': '❌', 'removed_time': d.get('removed_time') or now})
+            updated.append(d)
+        
+        # 重新获取资料必然刷新 summary_updated，比较时忽略该字段，未变化的行只批量更新时间戳
+        changed, touched = [], {}
+        for row in updated:
+            old = before.get(row['steamid'])
+            if old is None or {**row, 'summary_updated': 0} != {**old, 'summary_updated': 0}:
+                changed.append(row)
+            elif row['steamid'] in current and row.get('summary_updated') != old.get('summary_updated'):
+                touched.setdefault(row['summary_updated'], []).append(row['steamid'])
+        self.store.apply_changes(changed, self._refresh_events(before, changed), touched)
+        self.store.compact_events()
+        self.clear_checkpoint()
+        return updated
+
+    def _refresh_events(self, before, changed):
+        """对比刷新前后的记录生成好友事件"""
+        now, events = int(time.time()), []
+        for row in changed:
+            old = before.get(row['steamid'])
+            event = {'time': now, 'steamid': row['steamid'], 'name': row['name']}
+            if row['is_friend'] == '✅' and (not old or old['is_friend'] != '✅'):
+                events.append({**event, 'event': 'added', 'time': row.get('friend_since') or now})
+            elif row['is_friend'] != '✅' and old and old['is_friend'] == '✅':
+                events.append({**event, 'event': 'removed'})
+            if old and old['name'] != row['name']:
+                events.append({**event, 'event': 'renamed', 'old': old['name'], 'new': row['name']})
+        return events
+
+    def friend_history(self, event=None, since=None, until=None, steamid=None):
+        """查询好友事件，since/until 可以是时间戳或 datetime，例如某月内删除我的好友：
+        friend_history('removed', datetime(2024, 3, 1), datetime(2024, 4, 1))
+        """
+        since, until = [int(t.timestamp()) if isinstance(t, datetime) else t for t in (since, until)]
+        return self.store.history(event, since, until, steamid)
+
+    def delete_non_friends(self):
+        """删除非好友记录"""
+        self.store.delete_non_friends()
+        return self.read_friends_data()
+
+    def remove_friend(self, friend_steamid):
+        """删除好友"""
+        response = self.sess.post(self.urls['remove_friend'], params={
+            'key': self.steam_web_api,
+            'steamid': self.steam_id,
+            'friendid': friend_steamid
+        })
+        
+        if response.status_code == 200:
+            return True
+        elif response.status_code == 401:
+            raise Exception("Unauthorized，请检查你的steam隐私设置")
+        elif response.status_code == 403:
+            raise Exception("403 Forbidden，请检查你的web_api和id的值")
+        elif response.status_code == 500:
+            raise Exception("服务器内部错误，请检查你的steamid的值")
+        else:
+            raise Exception(f"删除好友失败，状态码：{response.status_code}")
+    
+    def remove_friends(self, steamids, on_progress=None):
+        """通过受限速的线程池并发删除多个好友，每成功一个立即写入存储
+        
+        on_progress(已完成数, 总数, steamid, 错误信息) 在每项完成后调用，返回 (成功列表, 失败描述列表)
+        """
+        removed, failed = [], []
+        if not steamids: return removed, failed
+        
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(steamids))) as pool:
+            futures = {pool.submit(self.remove_friend, steamid): steamid for steamid in steamids}
+            for done, future in enumerate(as_completed(futures), 1):
+                steamid, error = futures[future], None
+                try:
+                    future.result()
+                    row = self.store.get(steamid)
+                    if row and row['is_friend'] == '✅':
+                        self.store.update_many_with_events(
+                            {steamid: {'is_friend': '❌', 'removed_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}},
+                            [{'time': int(time.time()), 'steamid': steamid, 'event': 'removed', 'name': row['name'], 'new': 'manual'}]
+                        )
+                    removed.append(steamid)
+                except Exception as e:
+                    error = str(e)
+                    failed.append(f"{steamid} ({error})")
+                if on_progress:
+                    on_progress(done, len(steamids), steamid, error)
+        return removed, failed
+    
+    def get_user_info(self, friend_code):
+        """通过好友代码获取用户信息"""
+        # 将好友代码转换为SteamID64
+        steamid64 = self._friend_code_to_steamid(friend_code)
+        
+        if not steamid64:
+            raise Exception("无效的好友代码")
+        
+        # SteamID64 已知，附加查询与资料查询同时发出
+        extras = {
+            'game_count': (self.lookup_pool.submit(self.get_user_game_count, steamid64), 0, '游戏数量'),
+            'ban_info': (self.lookup_pool.submit(self.get_user_ban_info, steamid64), None, '封禁信息'),
+            'recent_game': (self.lookup_pool.submit(self.get_recent_most_played_game, steamid64), None, '最近游戏信息')
+        }
+        
+        url, params = self._profile_request('summary', steamid64)
+        user_info = self._parse_user_summary(self._make_request(url, params, timeout=self.profile_timeout))
+        
+        # 等待游戏数量、封禁信息、最近游戏信息，超时的项使用默认值
+        deadline = time.time() + self.profile_timeout
+        for key, (future, default, label) in extras.items():
+            try:
+                user_info[key] = future.result(timeout=max(0, deadline - time.time()))
+            except Exception as e:
+                print(f"获取{label}超时或失败: {e!r}")
+                user_info[key] = default
+        return user_info
+    
+    def _profile_request(self, kind, steamid64):
+        """用户信息相关接口的URL和参数"""
+        if kind == 'summary':
+            return f"{self.base_url}/ISteamUser/GetPlayerSummaries/v2/", {'key': self.steam_web_api, 'steamids': steamid64}
+        if kind == 'game_count':
+            return f"{self.base_url}/IPlayerService/GetOwnedGames/v0001/", {
+                'key': self.steam_web_api,
+                'steamid': steamid64,
+                'include_played_free_games': '1',
+                'format': 'json'
+            }
+        if kind == 'ban_info':
+            return f"{self.base_url}/ISteamUser/GetPlayerBans/v0001/", {'key': self.steam_web_api, 'steamids': steamid64}
+        return f"{self.base_url}/IPlayerService/GetRecentlyPlayedGames/v0001/", {'key': self.steam_web_api, 'steamid': steamid64}
+    
+    def _parse_user_summary(self, response):
+        """解析用户资料响应，失败时抛出异常"""
+        if response.status_code == 200:
+            data = response.json()
+            
+            if 'response' in data and 'players' in data['response'] and len(data['response']['players']) > 0:
+                return data['response']['players'][0]
+            else:
+                raise Exception("未找到用户信息")
+        elif response.status_code == 401:
+            raise Exception("API密钥无效或已过期")
+        elif response.status_code == 500:
+            raise Exception("Steam服务器内部错误")
+        else:
+            raise Exception(f"获取用户信息失败: HTTP {response.status_code}")
+    
+    def get_user_game_count(self, steamid64):
+        """获取用户游戏数量"""
+        try:
+            url, params = self._profile_request('game_count', steamid64)
+            return self._parse_game_count(self._make_request(url, params, timeout=self.profile_timeout))
+        except Exception as e:
+            print(f"获取游戏数量失败: {e}")
+            return 0
+    
+    def _parse_game_count(self, response):
+        if response.status_code == 200:
+            data = response.json()
+            if 'response' in data and 'game_count' in data['response']:
+                return data['response']['game_count']
+            else:
+                return 0
+        else:
+            # 如果获取游戏数量失败，返回0
+            return 0
+    
+    def get_user_ban_info(self, steamid64):
+        """获取用户封禁信息"""
+        try:
+            url, params = self._profile_request('ban_info', steamid64)
+            return self._parse_user_bans(self._make_request(url, params, timeout=self.profile_timeout))
+        except Exception as e:
+            print(f"获取封禁信息失败: {e}")
+            return None
+    
+    def _parse_user_bans(self, response):
+        if response.status_code == 200:
+            data = response.json()
+            if 'players' in data and len(data['players']) > 0:
+                return self._parse_ban_info(data['players'][0])
+            else:
+                return None
+        else:
+            # 如果获取封禁信息失败，返回None
+            return None
+    
+    def _parse_ban_info(self, ban_info):
+        return {
+            'VACBanned': ban_info.get('VACBanned', False),
+            'NumberOfVACBans': ban_info.get('NumberOfVACBans', 0),
+            'DaysSinceLastBan': ban_info.get('DaysSinceLastBan', 0),
+            'NumberOfGameBans': ban_info.get('NumberOfGameBans', 0),
+            'CommunityBanned': ban_info.get('CommunityBanned', False),
+            'EconomyBan': ban_info.get('EconomyBan', 'none')
+        }
+
+    def _fetch_bans_batch(self, batch):
+        """查询一批（最多100个）用户的封禁信息，返回 {steamid: 封禁字段}"""
+        # 扫描结果直接写入好友数据并由 ban_checked 控制有效期，不经过响应缓存，否则强制重新扫描也会命中旧结果
+        url = f"{self.base_url}/ISteamUser/GetPlayerBans/v0001/"
+        response = self.sess.get(url, params={'key': self.steam_web_api, 'steamids': ','.join(batch)})
+        
+        if response.status_code != 200:
+            raise Exception(f"获取封禁信息失败: HTTP {response.status_code}")
+        
+        checked = int(time.time())
+        results = {}
+        for player in response.json().get('players', []):
+            ban = self._parse_ban_info(player)
+            results[player['SteamId']] = {
+                'vac_banned': int(bool(ban['VACBanned'])), 'vac_bans': ban['NumberOfVACBans'],
+                'game_bans': ban['NumberOfGameBans'], 'days_since_last_ban': ban['DaysSinceLastBan'],
+                'community_banned': int(bool(ban['CommunityBanned'])), 'economy_ban': ban['EconomyBan'],
+                'ban_checked': checked
+            }
+        return results
+
+    def scan_friend_bans(self, ttl=24 * 3600):
+        """批量并发扫描好友封禁记录，只查询超过 ttl 秒未扫描的好友，返回 (扫描数, 有封禁记录的好友数)"""
+        if not self.friends_list:
+            self.get_friend_list()
+        
+        now = int(time.time())
+        checked = {row['steamid']: row.get('ban_checked') or 0 for row in self.read_friends_data()}
+        stale = [sid for sid in self.friends_list if sid in checked and now - checked[sid] >= ttl]
+        batches = [stale[i:i+100] for i in range(0, len(stale), 100)]
+        if not batches: return 0, 0
+        
+        banned, errors = 0, []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            # 按完成顺序逐批写入，失败的批次不影响其他批次，全部结束后再抛出
+            for future in as_completed([pool.submit(self._fetch_bans_batch, batch) for batch in batches]):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                self.store.update_many(results)
+                banned += sum(1 for r in results.values() if r['vac_banned'] or r['game_bans'] or r['community_banned'])
+        if errors:
+            raise Exception(f"{len(errors)}/{len(batches)} 批封禁信息获取失败，其余批次已保存，下次扫描会跳过：{errors[0]}")
+        return len(stale), banned
+
+    def get_recent_most_played_game(self, steamid64):
+        """获取两周内玩的最多的游戏"""
+        try:
+            url, params = self._profile_request('recent_game', steamid64)
+            return self._parse_recent_game(self._make_request(url, params, timeout=self.profile_timeout))
+        except Exception as e:
+            print(f"获取最近游戏信息失败: {e}")
+            return None
+    
+    def _parse_recent_game(self, response):
+        if response.status_code == 200:
+            data = response.json()
+            if 'response' in data:
+                games = data['response'].get('games', [])
+                
+                if not games:
+                    return None  # 最近2周没有游玩记录
+                
+                # 按两周内时长降序排序，取第一个
+                most_played = sorted(games, key=lambda x: x.get('playtime_2weeks', 0), reverse=True)[0]
+                
+                return {
+                    'name': most_played.get('name', '未知游戏'),
+                    'appid': most_played.get('appid', 0),
+                    'playtime_2weeks': most_played.get('playtime_2weeks', 0),
+                    'playtime_forever': most_played.get('playtime_forever', 0),
+                    'img_icon_url': most_played.get('img_icon_url', ''),
+                    'img_logo_url': most_played.get('img_logo_url', '')
+                }
+            else:
+                return None
+        else:
+            # 如果获取最近游戏信息失败，返回None
+            return None
+    
+    def send_friend_request(self, steamid64):
+        """发送好友申请"""
+        url = f"{self.base_url}/ISteamUser/AddFriend/v1/"
+        params = {
+            'key': self.steam_web_api,
+            'steamid': self.steam_id,
+            'friendid': steamid64
+        }
+        
+        response = self._make_request(url, params)
+        if response.status_code == 200:
+            return True
+        elif response.status_code == 401:
+            raise Exception("API密钥无效或已过期")
+        elif response.status_code == 403:
+            raise Exception("权限不足，无法发送好友申请")
+        elif response.status_code == 500:
+            raise Exception("Steam服务器内部错误")
+        else:
+            raise Exception(f"发送好友申请失败: HTTP {response.status_code}")
+    
+    def _make_request(self, url, params, timeout=None):
+        """发送HTTP请求，可缓存的接口优先使用未过期的缓存"""
+        started = metrics.start()
+        cached = self.response_cache.get(url, params)
+        if cached:
+            metrics.observe('api_call', started, cached.status_code, url=url, cache='hit')
+            return cached
+        
+        response = self.sess.get(url, params=params, timeout=timeout)
+        self.response_cache.put(url, params, response)
+        metrics.observe('api_call', started, response.status_code, url=url, cache='miss')
+        return response
+    
+    def _friend_code_to_steamid(self, friend_code):
+        """将好友代码转换为SteamID64"""
+        try:
+            # 移除可能的格式字符
+            friend_code = friend_code.strip().replace('-', '').replace(' ', '')
+            
+            # 检查是否是数字格式（直接是SteamID64）
+            if friend_code.isdigit() and len(friend_code) == 17:
+                return friend_code
+            
+            # 检查是否是SteamID格式（STEAM_0:0:12345678）
+            if friend_code.startswith('STEAM_'):
+                parts = friend_code.split(':')
+                if len(parts) == 3:
+                    y = int(parts[1])
+                    z = int(parts[2])
+                    steamid64 = str(76561197960265728 + (z * 2) + y)
+                    return steamid64
+            
+            # 检查是否是纯数字（可能是SteamID32或其他格式）
+            if friend_code.isdigit():
+                # 尝试将数字转换为SteamID64
+                # SteamID64 = 76561197960265728 + SteamID32
+                steamid32 = int(friend_code)
+                steamid64 = str(76561197960265728 + steamid32)
+                return steamid64
+            
+            # 检查是否是好友代码格式（FCABC-DEF-GHI）
+            if len(friend_code) >= 8 and friend_code.isalnum():
+                # Steam好友代码转换算法
+                try:
+                    # 如果是17位数字，直接返回
+                    if len(friend_code) == 17:
+                        return friend_code
+                    
+                    # 尝试解析为Steam好友代码
+                    # Steam好友代码使用Base58编码
+                    
+                    # Base58字符集
+                    base58_chars = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+                    
+                    # 反转字符串以便计算
+                    friend_code_reversed = friend_code[::-1]
+                    
+                    # Base58解码
+                    code_num = 0
+                    for i, char in enumerate(friend_code_reversed):
+                        if char in base58_chars:
+                            code_num += base58_chars.index(char) * (58 ** i)
+                        else:
+                            return None
+                    
+                    # 转换为SteamID64
+                    # SteamID64 = 76561197960265728 + code_num
+                    steamid64 = str(76561197960265728 + code_num)
+                    return steamid64
+                    
+                except Exception as e:
+                    return None
+            
+            return None
+        except Exception as e:
+            return None